@@ -0,0 +1,144 @@
+"""Precomputed aggregates of the building metrics per admin region and building type.
+
+The only rollup used to be the per-NAME_3 maximum of geodata_cache.py; any
+other statistic meant another groupby over every building.  The cube holds
+all of them, computed in one vectorized pass over the building store:
+
+* regions at every level of ``LEVELS`` (NAME_1, NAME_1/NAME_2 and
+  NAME_1/NAME_2/NAME_3, so barangays sharing a name in different cities
+  stay apart),
+* per building type and over all types,
+* per metric: count, sum, mean, min, max and the ``PERCENTILES``.
+
+Callbacks then answer by lookup.  The store is immutable, so the cube is
+rebuilt with it (percentiles cannot be merged incrementally anyway); a pass
+over a million buildings is a handful of sorts.
+"""
+import numpy as np
+import pandas as pd
+
+from building_store import METRICS
+
+LEVELS = ['NAME_1', 'NAME_2', 'NAME_3']
+PERCENTILES = {'p25': 25, 'p50': 50, 'p75': 75, 'p90': 90}
+STATISTICS = ['count', 'sum', 'mean', 'min', 'max'] + list(PERCENTILES)
+
+
+def sort_by_group(group, values):
+    """``values`` sorted by (group, value).
+
+    float32 values are sorted with their group in a single int64 key (the
+    group in the high bits, the float bits flipped so that their unsigned
+    order is the numeric order), several times faster than a lexsort.
+    """
+    if values.dtype != np.float32:
+        return values[np.lexsort((values, group))]
+    bits = values.view(np.uint32).astype('int64')
+    bits = np.where(bits & 0x80000000, bits ^ 0xFFFFFFFF, bits | 0x80000000)
+    keys = np.sort((group.astype('int64') << 32) | bits)
+    bits = keys & 0xFFFFFFFF
+    return np.where(bits & 0x80000000, bits ^ 0x80000000, bits ^ 0xFFFFFFFF).astype(np.uint32).view(np.float32)
+
+
+def group_statistics(group, values, group_count):
+    """Every statistic of ``values`` per ``group`` id, shape ``(group_count, len(STATISTICS))``.
+
+    NaN values are left out.  The values are sorted once by (group, value),
+    so min, max and the percentiles are offsets into each group's run;
+    percentiles interpolate linearly like ``np.percentile``.
+    """
+    valid = ~np.isnan(values)
+    group = group[valid]
+    sorted_values = sort_by_group(group, values[valid]).astype('float64')
+    values = values[valid].astype('float64')
+    counts = np.bincount(group, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+
+    result = np.full((group_count, len(STATISTICS)), np.nan)
+    result[:, 0] = counts
+    result[:, 1] = np.bincount(group, weights=values, minlength=group_count)
+    present = counts > 0
+    size = counts[present]
+    first = starts[present]
+    result[present, 2] = result[present, 1] / size
+    result[present, 3] = sorted_values[first]
+    result[present, 4] = sorted_values[first + size - 1]
+    for column, percentile in enumerate(PERCENTILES.values(), start=5):
+        position = first + (size - 1) * percentile / 100
+        lower = np.floor(position).astype('int64')
+        upper = np.ceil(position).astype('int64')
+        result[present, column] = (sorted_values[lower]
+                                   + (sorted_values[upper] - sorted_values[lower]) * (position - lower))
+    return result
+
+
+class AggregationCube:
+    """Region x building type x metric x statistic array built from a ``BuildingStore``."""
+
+    def __init__(self, store, levels=LEVELS, category='b_type', missing_label='n.a.'):
+        self.levels = list(levels)
+        self.metrics = list(METRICS)
+        category_codes = store.codes[category].astype('int64')
+        self.categories = [str(label) for label in store.labels[category]]
+        if (category_codes < 0).any():
+            category_codes = np.where(category_codes < 0, len(self.categories), category_codes)
+            self.categories.append(missing_label)
+        category_count = len(self.categories)
+        # Per building: its position in ``categories`` and, per level, in ``regions(level)`` (-1 outside)
+        self.row_categories = category_codes.astype('int32')
+        self.row_regions = {}
+
+        # level -> MultiIndex of the region paths, and level -> array of shape
+        # (regions, categories + 1, metrics, statistics); the last category is "all".
+        self._regions = {}
+        self._values = {}
+        for depth, level in enumerate(self.levels, start=1):
+            path = self.levels[:depth]
+            path_codes = np.column_stack([store.codes[column] for column in path]).astype('int64')
+            inside = (path_codes >= 0).all(axis=1)
+            unique_paths, region = np.unique(path_codes[inside], axis=0, return_inverse=True)
+            region = region.reshape(-1)
+            region_count = len(unique_paths)
+            self.row_regions[level] = np.full(len(inside), -1, dtype='int32')
+            self.row_regions[level][inside] = region
+            self._regions[level] = pd.MultiIndex.from_arrays(
+                [store.labels[column][unique_paths[:, position]] for position, column in enumerate(path)], names=path)
+
+            cells = np.empty((region_count, category_count + 1, len(self.metrics), len(STATISTICS)))
+            by_category = region * category_count + category_codes[inside]
+            for position, metric in enumerate(self.metrics):
+                values = store.metrics[metric][inside]
+                cells[:, :category_count, position] = group_statistics(
+                    by_category, values, region_count * category_count).reshape(region_count, category_count, -1)
+                cells[:, category_count, position] = group_statistics(region, values, region_count)
+            self._values[level] = cells
+
+    def _cells(self, level, metric, statistic, category):
+        category_position = len(self.categories) if category is None else self.categories.index(category)
+        return self._values[level][:, category_position, self.metrics.index(metric), STATISTICS.index(statistic)]
+
+    def regions(self, level):
+        """Region paths of ``level`` that have buildings, as a DataFrame."""
+        return self._regions[level].to_frame(index=False)
+
+    def lookup(self, level, keys, metric, statistic, category=None):
+        """Aggregate of ``metric`` for the regions in ``keys``, aligned with its rows.
+
+        ``keys`` is a DataFrame holding the path columns of ``level`` (e.g.
+        NAME_1, NAME_2 and NAME_3).  ``category`` restricts the aggregate to
+        one building type.  Regions without buildings get a count and sum of
+        0 and NaN for the other statistics.
+        """
+        regions = self._regions[level]
+        positions = regions.get_indexer(pd.MultiIndex.from_frame(keys[list(regions.names)]))
+        cells = self._cells(level, metric, statistic, category)
+        empty = 0.0 if statistic in ('count', 'sum') else np.nan
+        values = np.full(len(positions), empty)
+        values[positions >= 0] = cells[positions[positions >= 0]]
+        return values
+
+    def table(self, level, metric, statistic, category=None):
+        """Every region of ``level`` with one aggregate in a ``value`` column."""
+        frame = self.regions(level)
+        frame['value'] = self._cells(level, metric, statistic, category)
+        return frame
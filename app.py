@@ -1,44 +1,188 @@
-from dash import Dash, html, dcc, callback, Output, Input
+from dash import Dash, html, dcc, callback, Output, Input, State, Patch, ALL
 import dash
 import dash_bootstrap_components as dbc
 import plotly.express as px
-import geopandas as gpd
 import pandas as pd
+import numpy as np
 from pathlib import Path
+import os
+import json
+import logging
+import threading
+from functools import lru_cache, partial, wraps
+from flask import jsonify, request, has_request_context
 from dash.dependencies import Input, Output
 import plotly.graph_objs as go
-from geopy.geocoders import Nominatim
+
+# Only light modules here; the geospatial ones are imported by load_geodata()
+from geodata_cache import BATCH_FOLDER, METRIC_COLUMNS, SOURCE_FILES
+from partition_index import PartitionIndex
+from figure_cache import FigureCache
+from geometry_levels import register_geojson_route, view_for_bounds
+from vector_tiles import MAP_MAX_ZOOM, MAX_ZOOM, VectorTileSource, register_tile_route
+from building_api import register_building_api
+from static_figures import StaticFigureStore, register_figure_route
+from clustering import GridClusterIndex, viewport_from_relayout
+from instrumentation import instrument_callback, measure, register_metrics_route, registry, startup_phase
+from data_refresh import DatasetWatcher, SwapLock
+
+logger = logging.getLogger(__name__)
 
 # Data Preprocessing
 dataset_folder = Path('datasets')
-solar_data = gpd.read_file(dataset_folder / 'solar_data.geojson', driver='GeoJSON')
-gadm_data = gpd.read_file(dataset_folder / 'gadm41_PHL_shp/gadm41_PHL_3.shp')
-consump = pd.read_csv(dataset_folder / 'Consumption CO2 Philippines.csv')
-gener = pd.read_csv(dataset_folder / 'Electricity generation by source Philippines.csv')
-share = pd.read_csv(dataset_folder / 'Energy Share in the Philippines.csv')
-px.set_mapbox_access_token(open(".mapbox_token").read())
-converted_gdf = solar_data.copy()
-converted_gdf = converted_gdf.to_crs("EPSG:4326")
-converted_gdf_subset = converted_gdf[['geometry', 'capacity','suitarea','potential']]
-converted_gdf_indexed = converted_gdf.set_index('city')
-
-metro_manila_data = gadm_data.query("NAME_1 == 'Metropolitan Manila'")
-metro_manila_data = metro_manila_data[["NAME_2","NAME_3", "geometry"]]
-metro_manila_data.head(60)
-merged_data = gpd.sjoin(converted_gdf, metro_manila_data, how='inner', op='within')
-merged_data = merged_data.rename(columns={'capacity':'Estimated Capacity (kWp)','suitarea':'Estimated Suitable Area (sq.m)', 'potential':'Estimated Yearly Potential Power (kWh)'})
-valid_indices = merged_data['index_right'].unique()
-
-filtered_gadm_data = gadm_data[gadm_data.index.isin(valid_indices)]
-max_group_per_name3 = merged_data.groupby('NAME_3')[['Estimated Capacity (kWp)','Estimated Suitable Area (sq.m)','Estimated Yearly Potential Power (kWh)']].max().reset_index()
-gadm_data_with_group = filtered_gadm_data.merge(max_group_per_name3, on='NAME_3', how='left')
-# gadm_data_with_group = gadm_data_with_group.rename(columns={'capacity':'Estimated Capacity (kWp)','suitarea':'Estimated Suitable Area (sq.m)', 'potential':'Estimated Yearly Potential Power (kWh)'})
-gadm_data_with_group = gadm_data_with_group[gadm_data_with_group['NAME_3'] != 'n.a.']
-# gadm_data_with_group.head()
-gadm_data_with_dropdup_group = gadm_data_with_group.drop_duplicates(subset=['NAME_3'])
-gadm_data_with_dropdup_group_sorted = gadm_data_with_dropdup_group.sort_values(by='Estimated Capacity (kWp)', ascending=False).head(20)
+mapbox_token = open(".mapbox_token").read()
+px.set_mapbox_access_token(mapbox_token)
+
+# The spatial pipeline (read, to_crs, sjoin, groupby) lives in geodata_cache.py
+# and is only re-run when one of the source files changes.
+# Buildings are read from one compact columnar store (building_store.py); with
+# SOLAR_SHARED_STORE=1 it is memory-mapped and shared by all workers (the indexes built from it are not).
+shared_store = os.environ.get('SOLAR_SHARED_STORE', '0') == '1'
+
+# A city is keyed by (NAME_1, NAME_2), since many NAME_2 are a city in several provinces;
+# the location dropdown carries that pair as JSON
+def location_value(location):
+    return json.dumps(list(location))
+
+def parse_location(value):
+    return tuple(json.loads(value)) if value else None
+
+def location_label(location):
+    name_1, name_2 = location
+    return f'{name_2}, {name_1}'
+
+def load_geodata():
+    from geodata_cache import load_artifacts, load_building_store
+    from building_api import BuildingQueryEngine
+    from aggregation_cube import AggregationCube
+    from scenarios import ScenarioEngine
+    from geometry_levels import SimplifiedGeometryStore
+    from reverse_geocoder import ReverseGeocoder, remote_backend_from_env
+
+    with startup_phase('load_artifacts'):
+        artifacts = load_artifacts(dataset_folder, names=['gadm_data', 'gadm_data_with_group', 'gadm_data_with_dropdup_group'])
+        buildings = load_building_store(dataset_folder, memory_map=shared_store)
+    gadm_data = artifacts['gadm_data']
+    gadm_data_with_group = artifacts['gadm_data_with_group']
+    gadm_data_with_dropdup_group = artifacts['gadm_data_with_dropdup_group']
+    geodata = {
+        'gadm_data': gadm_data,
+        'gadm_data_with_group': gadm_data_with_group,
+        'gadm_data_with_dropdup_group': gadm_data_with_dropdup_group,
+        'gadm_data_with_dropdup_group_sorted': gadm_data_with_dropdup_group.sort_values(by='Estimated Capacity (kWp)', ascending=False).head(20),
+        'buildings': buildings,
+        'solar_options': [{'label': i, 'value': i} for i in gadm_data_with_group.columns[17:]],
+        'location_options': [{'label': location_label(location), 'value': location_value(location)}
+                             for location in gadm_data_with_dropdup_group[['NAME_1', 'NAME_2']].drop_duplicates().itertuples(index=False)],
+    }
+
+    # Row-offset indexes per city (NAME_1, NAME_2) so the choropleth callbacks only touch the selected city
+    with startup_phase('partition_index'):
+        geodata['gadm_data_with_group_by_location'] = PartitionIndex(gadm_data_with_group, ['NAME_1', 'NAME_2'])
+        geodata['gadm_data_with_dropdup_group_by_location'] = PartitionIndex(gadm_data_with_dropdup_group, ['NAME_1', 'NAME_2'])
+
+    # Count/sum/mean/min/max/percentiles of every metric per region and building type,
+    # so the choropleth page answers any aggregate by lookup
+    with startup_phase('aggregation_cube'):
+        geodata['aggregation_cube'] = AggregationCube(buildings)
+    # What-if scenarios (panel efficiency, adoption per building type, degradation) derived from the cube
+    geodata['scenario_engine'] = ScenarioEngine(buildings, geodata['aggregation_cube'])
+
+    # Simplified GADM polygons per city at several tolerances, served as static GeoJSON
+    with startup_phase('simplify_geometry'):
+        geodata['region_geometry'] = SimplifiedGeometryStore(gadm_data_with_group, ['NAME_1', 'NAME_2'])
+
+    # Clicks are resolved offline against the GADM polygons; set REVERSE_GEOCODER_REMOTE=nominatim for street addresses
+    with startup_phase('reverse_geocoder'):
+        geodata['geolocator'] = ReverseGeocoder(gadm_data, remote=remote_backend_from_env())
+    # Buildings are clustered server-side per zoom level; the map only receives what is in its viewport
+    with startup_phase('cluster_index'):
+        geodata['cluster_index'] = GridClusterIndex(buildings.lon, buildings.lat, buildings.codes['b_type'],
+                                                    category_labels=buildings.labels['b_type'])
+    # Boundaries and footprints for the map layers, cut into vector tiles on demand
+    geodata['tile_source'] = VectorTileSource(dataset_folder)
+    # Grid index of the centroids for the bulk query API on /api/buildings
+    with startup_phase('building_query'):
+        geodata['building_query'] = BuildingQueryEngine(buildings)
+    return geodata
+
+# The callbacks read the geodata as module globals while holding data_lock for
+# reading, so a reload (see Data refresh below) swaps all of it in between them
+data_lock = SwapLock()
+
+def install_geodata(geodata):
+    global gadm_data, gadm_data_with_group, gadm_data_with_dropdup_group, gadm_data_with_dropdup_group_sorted
+    global buildings, solar_options, location_options, gadm_data_with_group_by_location
+    global gadm_data_with_dropdup_group_by_location, aggregation_cube, region_geometry, geolocator, cluster_index
+    global tile_source, building_query, scenario_engine
+    gadm_data = geodata['gadm_data']
+    gadm_data_with_group = geodata['gadm_data_with_group']
+    gadm_data_with_dropdup_group = geodata['gadm_data_with_dropdup_group']
+    gadm_data_with_dropdup_group_sorted = geodata['gadm_data_with_dropdup_group_sorted']
+    buildings = geodata['buildings']
+    solar_options = geodata['solar_options']
+    location_options = geodata['location_options']
+    gadm_data_with_group_by_location = geodata['gadm_data_with_group_by_location']
+    gadm_data_with_dropdup_group_by_location = geodata['gadm_data_with_dropdup_group_by_location']
+    aggregation_cube = geodata['aggregation_cube']
+    region_geometry = geodata['region_geometry']
+    geolocator = geodata['geolocator']
+    cluster_index = geodata['cluster_index']
+    tile_source = geodata['tile_source']
+    building_query = geodata['building_query']
+    scenario_engine = geodata['scenario_engine']
+
+# Nothing geospatial is loaded at import, so the server starts and the home page renders right
+# away; it is loaded once, in the background after startup or by the first map page that needs it
+geodata_loaded = threading.Event()
+geodata_load_lock = threading.Lock()
+
+def ensure_geodata():
+    if geodata_loaded.is_set():
+        return
+    with geodata_load_lock:
+        if not geodata_loaded.is_set():
+            geodata = load_geodata()
+            with data_lock.swapping():
+                install_geodata(geodata)
+            geodata_loaded.set()
+
+def uses_geodata(function):
+    # For callbacks reading the geodata: wait for it to be loaded, then hold data_lock for reading
+    locked = data_lock.reader(function)
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        ensure_geodata()
+        return locked(*args, **kwargs)
+    return wrapper
+
+def current_region_geometry():
+    ensure_geodata()
+    return region_geometry
+
+def current_tile_source():
+    ensure_geodata()
+    return tile_source
+
+def current_building_query():
+    ensure_geodata()
+    return building_query
+
+# LRU cache of choropleth page figures keyed on (metric, aggregate, city, graph id)
+figure_cache = FigureCache(max_bytes=int(os.environ.get('FIGURE_CACHE_MAX_MB', '256')) * 1024 * 1024)
+# Number of cities whose default view is prebuilt at startup (0 disables the warm-up)
+figure_cache_warmup = int(os.environ.get('FIGURE_CACHE_WARMUP', '3'))
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],suppress_callback_exceptions=True, assets_folder='assets', assets_url_path='/assets/')
+# WSGI entry point, e.g. gunicorn app:server
+server = app.server
+
+register_geojson_route(app.server, current_region_geometry)
+register_tile_route(app.server, current_tile_source)
+# Bulk building queries streamed as NDJSON or Arrow, see building_api.py
+register_building_api(app.server, current_building_query)
+# Per-callback latency/payload histograms on /metrics when SOLAR_METRICS=1
+register_metrics_route(app.server)
 
 navbar = dbc.NavbarSimple(
     children=[
@@ -54,228 +198,287 @@ navbar = dbc.NavbarSimple(
 )
 
 # ==== Electricity and CO2 Emissions Graph ===
-# Create traces
-trace1 = go.Scatter(x=consump['Year'], y=consump['Electricity consumption'], mode='lines+markers', name='Electricity Consumption', visible=True, line=dict(color='#4477AA'))
-trace2 = go.Scatter(x=consump['Year'], y=consump['CO2 emissions'], mode='lines+markers', name='CO2 Emissions', visible=True, line=dict(color='#CCBB44'))
-
-
-# Create layout
-layout = go.Layout(title=go.layout.Title(text='Electricity Consumption and CO2 Emissions in the PH (1990-2021)', xanchor='left'),
-                   xaxis=dict(title='Year'),
-                   yaxis=dict(title='Consumption and Emissions'),
-                   updatemenus=[dict(x=0.05,
-                                     y=0.95,  # Adjusting the 'y' value slightly downwards
-                                     xanchor='left',
-                                     yanchor='top',
-                                     buttons=[{'label': 'Electricity Consumption',
-                                               'method': 'update',
-                                               'args': [{'visible': [True, False]},
-                                                        {'yaxis': {'title': 'Electricity Consumption (Terawatt hours, TWh)'}}]},
-                                              {'label': 'CO2 Emissions',
-                                               'method': 'update',
-                                               'args': [{'visible': [False, True]},
-                                                        {'yaxis': {'title': 'CO2 Emissions (Megatons, Mt)'}}]},
-                                              {'label': 'Both',
-                                               'method': 'update',
-                                               'args': [{'visible': [True, True]},
-                                                        {'yaxis': {'title': 'Consumption and Emissions'}}]}],
-                                     # Set the default state of the dropdown to 'Both'
-                                     direction='down',
-                                     showactive=True,
-                                     active=2)])
-
-# Add hover info with units
-trace1.hoverinfo = 'x+y+text'
-trace2.hoverinfo = 'x+y+text'
-
-# Define hover template with units
-hover_template_electricity = 'Year: %{x}<br>%{y} TWh'
-hover_template_co2 = 'Year: %{x}<br>%{y} Mt'
-
-# Update hover templates
-trace1.hovertemplate = hover_template_electricity
-trace2.hovertemplate = hover_template_co2
-
-consump_fig = go.Figure(data=[trace1, trace2], layout=layout)
+def build_consumption_figure(consump):
+    # Create traces
+    trace1 = go.Scatter(x=consump['Year'], y=consump['Electricity consumption'], mode='lines+markers', name='Electricity Consumption', visible=True, line=dict(color='#4477AA'))
+    trace2 = go.Scatter(x=consump['Year'], y=consump['CO2 emissions'], mode='lines+markers', name='CO2 Emissions', visible=True, line=dict(color='#CCBB44'))
+
+
+    # Create layout
+    layout = go.Layout(title=go.layout.Title(text='Electricity Consumption and CO2 Emissions in the PH (1990-2021)', xanchor='left'),
+                       xaxis=dict(title='Year'),
+                       yaxis=dict(title='Consumption and Emissions'),
+                       updatemenus=[dict(x=0.05,
+                                         y=0.95,  # Adjusting the 'y' value slightly downwards
+                                         xanchor='left',
+                                         yanchor='top',
+                                         buttons=[{'label': 'Electricity Consumption',
+                                                   'method': 'update',
+                                                   'args': [{'visible': [True, False]},
+                                                            {'yaxis': {'title': 'Electricity Consumption (Terawatt hours, TWh)'}}]},
+                                                  {'label': 'CO2 Emissions',
+                                                   'method': 'update',
+                                                   'args': [{'visible': [False, True]},
+                                                            {'yaxis': {'title': 'CO2 Emissions (Megatons, Mt)'}}]},
+                                                  {'label': 'Both',
+                                                   'method': 'update',
+                                                   'args': [{'visible': [True, True]},
+                                                            {'yaxis': {'title': 'Consumption and Emissions'}}]}],
+                                         # Set the default state of the dropdown to 'Both'
+                                         direction='down',
+                                         showactive=True,
+                                         active=2)])
+
+    # Add hover info with units
+    trace1.hoverinfo = 'x+y+text'
+    trace2.hoverinfo = 'x+y+text'
+
+    # Define hover template with units
+    hover_template_electricity = 'Year: %{x}<br>%{y} TWh'
+    hover_template_co2 = 'Year: %{x}<br>%{y} Mt'
+
+    # Update hover templates
+    trace1.hovertemplate = hover_template_electricity
+    trace2.hovertemplate = hover_template_co2
+
+    return go.Figure(data=[trace1, trace2], layout=layout)
 # === End code ===
 
 # === Electricity Generation by Source Stacked Bar Chart ===
-colors = ['#4A4A4A', '#708090', '#96C98B', '#1E88E5', '#A52A2A', '#E88E5A', '#F2DB77', '#AED6F1', '#B8860B']
-fig_gen = go.Figure()
-# Add traces for each energy source
-for i, source in enumerate(['Coal', 'Oil', 'Biofuels', 'Hydro', 'Geothermal', 'Natural gas', 'Solar PV', 'Wind', 'Biomass']):
-    fig_gen.add_trace(go.Bar(
-        x=gener['Year'],
-        y=gener[source],
-        name=source,
-        marker_color=colors[i],
-        hoverinfo='y+name',  # Display only y-value and name on hover
-        hovertemplate='Year: %{x}<br>%{y} GWh'  # Include both y-value and x (Year) in hover
-    ))
-# Update layout
-fig_gen.update_layout(
-    barmode='stack',
-    title='Electricity Generation by Source in the PH (1990-2021)',
-    xaxis_title='Year',
-    yaxis_title='Electricity Generation (Gigawatt hours, GWh)',
-    showlegend=True,
-    updatemenus=[
-        {
-            'buttons': [
-                {
-                    'args': [None, {'showlegend': False}],
-                    'label': 'Show All',
-                    'method': 'relayout'
-                }
-            ],
-            'direction': 'down',
-            'showactive': True,
-            'x': 0.01,
-            'xanchor': 'left',
-            'y': 1,
-            'yanchor': 'top'
-        },
-        {
-            'buttons': [
-                {
-                    'args': [{'visible': [True] * len(fig_gen.data)}],
-                    'label': 'All',
-                    'method': 'update'
-                }
-            ],
-            'direction': 'down',
-            'showactive': True,
-            'x': 0.01,
-            'xanchor': 'left',
-            'y': 0.9,
-            'yanchor': 'top'
-        },
-        {
-            'buttons': [
-                {
-                    'args': [{'visible': [True if i == idx else False for i in range(len(fig_gen.data))]}],
-                    'label': source,
-                    'method': 'update'
-                } for idx, source in enumerate(['Coal', 'Oil', 'Biofuels', 'Hydro', 'Geothermal', 'Natural gas', 'Solar PV', 'Wind', 'Biomass'])
-            ],
-            'direction': 'down',
-            'showactive': True,
-            'x': 0.01,
-            'xanchor': 'left',
-            'y': 0.8,
-            'yanchor': 'top'
-        }
-    ]
-)
-# Add checkbox for each energy source
-fig_gen.update_layout(
-    updatemenus=[
-        {
-            'buttons': [
-                {
-                    'args': [{'visible': [True if i == idx else False for i in range(len(fig_gen.data))]}],
-                    'label': source,
-                    'method': 'update'
-                } for idx, source in enumerate(['Coal', 'Oil', 'Biofuels', 'Hydro', 'Geothermal', 'Natural gas', 'Solar PV', 'Wind', 'Biomass'])
-            ],
-            'direction': 'down',
-            'showactive': True,
-            'x': 0,
-            'xanchor': 'left',
-            'y': 1,
-            'yanchor': 'top'
-        },
-        {
-            'buttons': [
-                {
-                    'args': [{'visible': [True] * len(fig_gen.data)}],
-                    'label': 'All',
-                    'method': 'update'
-                }
-            ],
-            'direction': 'down',
-            'showactive': True,
-            'x': 0.01,
-            'xanchor': 'left',
-            'y': 0.89,  # Adjust the y position to place it below the dropdown menu
-            'yanchor': 'top'
-        }
-    ]
-)
+def build_generation_figure(gener):
+    colors = ['#4A4A4A', '#708090', '#96C98B', '#1E88E5', '#A52A2A', '#E88E5A', '#F2DB77', '#AED6F1', '#B8860B']
+    fig_gen = go.Figure()
+    # Add traces for each energy source
+    for i, source in enumerate(['Coal', 'Oil', 'Biofuels', 'Hydro', 'Geothermal', 'Natural gas', 'Solar PV', 'Wind', 'Biomass']):
+        fig_gen.add_trace(go.Bar(
+            x=gener['Year'],
+            y=gener[source],
+            name=source,
+            marker_color=colors[i],
+            hoverinfo='y+name',  # Display only y-value and name on hover
+            hovertemplate='Year: %{x}<br>%{y} GWh'  # Include both y-value and x (Year) in hover
+        ))
+    # Update layout
+    fig_gen.update_layout(
+        barmode='stack',
+        title='Electricity Generation by Source in the PH (1990-2021)',
+        xaxis_title='Year',
+        yaxis_title='Electricity Generation (Gigawatt hours, GWh)',
+        showlegend=True
+    )
+    # Add checkbox for each energy source
+    fig_gen.update_layout(
+        updatemenus=[
+            {
+                'buttons': [
+                    {
+                        'args': [{'visible': [True if i == idx else False for i in range(len(fig_gen.data))]}],
+                        'label': source,
+                        'method': 'update'
+                    } for idx, source in enumerate(['Coal', 'Oil', 'Biofuels', 'Hydro', 'Geothermal', 'Natural gas', 'Solar PV', 'Wind', 'Biomass'])
+                ],
+                'direction': 'down',
+                'showactive': True,
+                'x': 0,
+                'xanchor': 'left',
+                'y': 1,
+                'yanchor': 'top'
+            },
+            {
+                'buttons': [
+                    {
+                        'args': [{'visible': [True] * len(fig_gen.data)}],
+                        'label': 'All',
+                        'method': 'update'
+                    }
+                ],
+                'direction': 'down',
+                'showactive': True,
+                'x': 0.01,
+                'xanchor': 'left',
+                'y': 0.89,  # Adjust the y position to place it below the dropdown menu
+                'yanchor': 'top'
+            }
+        ]
+    )
+    return fig_gen
 # === End Code ===
 
 # === Renewable Energy Horizontal Bar Chart ===
-renewables_color = '#4477AA'
-nonrenewables_color = '#CCBB44'
-
-# Create initial data for the chart (Renewables and Nonrenewables)
-labels1 = ['Renewables', 'Nonrenewables']
-values1 = [share['Renewables'].iloc[0], share['Nonrenewables'].iloc[0]]
-
-# Create the horizontal bar chart
-fig1_bar = go.Figure(data=[go.Bar(y=labels1, x=values1,
-                              orientation='h',
-                              marker=dict(color=[renewables_color, nonrenewables_color]),
-                              name='Energy Share',
-                              hovertemplate='%{x}%<extra></extra>')])
-
-# Update layout for the chart (with title, legend, axis labels, and dropdown menu position)
-fig1_bar.update_layout(title_text="Energy Generation Share in the PH",
-                   title_x=0.5,  # Title position in the center
-                   title_y=0.98,  # Title position from the top
-                   margin=dict(l=100, r=20, t=60, b=80),  # Add space around the chart
-                   width=800,  # Set width
-                   height=400,  # Set height
-                   xaxis_title="%",  # X-axis label
-                   yaxis_title="Type of Energy",  # Y-axis label
-                   legend=dict(x=0.05, y=0.95),  # Position of the legend
-                   annotations=[
-                       dict(
-                           x=0.5,
-                           y=-0.32,
-                           xref='paper',
-                           yref='paper',
-                           text="Nonrenewables: Coal, Oil, Natural Gas<br>Renewables: Biofuels, Hydro, Geothermal, Solar PV, Wind, Biomass",
-                           showarrow=False,
-                           font=dict(size=10),
-                           align='center'
-                       )
-                   ],
-                   updatemenus=[dict(buttons=[
-                       dict(method='update',
-                            args=[{'y': [labels1],
-                                   'x': [[share['Renewables'].iloc[i], share['Nonrenewables'].iloc[i]]],
-                                   'marker.color': [[renewables_color, nonrenewables_color]],
-                                   'title': f"Energy Share in the PH - {year}"}],
-                            label=str(year)) for i, year in enumerate(share['Year'])],
-                                    direction='down',
-                                    showactive=True,
-                                    x=0.95,  # Position of the dropdown menu on the x-axis
-                                    xanchor='right',  # Align dropdown menu to the right
-                                    y=0.05,  # Position of the dropdown menu on the y-axis
-                                    yanchor='bottom')])
+def build_share_figure(share):
+    renewables_color = '#4477AA'
+    nonrenewables_color = '#CCBB44'
+
+    # Create initial data for the chart (Renewables and Nonrenewables)
+    labels1 = ['Renewables', 'Nonrenewables']
+    values1 = [share['Renewables'].iloc[0], share['Nonrenewables'].iloc[0]]
+
+    # Create the horizontal bar chart
+    fig1_bar = go.Figure(data=[go.Bar(y=labels1, x=values1,
+                                  orientation='h',
+                                  marker=dict(color=[renewables_color, nonrenewables_color]),
+                                  name='Energy Share',
+                                  hovertemplate='%{x}%<extra></extra>')])
+
+    # Update layout for the chart (with title, legend, axis labels, and dropdown menu position)
+    fig1_bar.update_layout(title_text="Energy Generation Share in the PH",
+                       title_x=0.5,  # Title position in the center
+                       title_y=0.98,  # Title position from the top
+                       margin=dict(l=100, r=20, t=60, b=80),  # Add space around the chart
+                       width=800,  # Set width
+                       height=400,  # Set height
+                       xaxis_title="%",  # X-axis label
+                       yaxis_title="Type of Energy",  # Y-axis label
+                       legend=dict(x=0.05, y=0.95),  # Position of the legend
+                       annotations=[
+                           dict(
+                               x=0.5,
+                               y=-0.32,
+                               xref='paper',
+                               yref='paper',
+                               text="Nonrenewables: Coal, Oil, Natural Gas<br>Renewables: Biofuels, Hydro, Geothermal, Solar PV, Wind, Biomass",
+                               showarrow=False,
+                               font=dict(size=10),
+                               align='center'
+                           )
+                       ],
+                       updatemenus=[dict(buttons=[
+                           dict(method='update',
+                                args=[{'y': [labels1],
+                                       'x': [[share['Renewables'].iloc[i], share['Nonrenewables'].iloc[i]]],
+                                       'marker.color': [[renewables_color, nonrenewables_color]],
+                                       'title': f"Energy Share in the PH - {year}"}],
+                                label=str(year)) for i, year in enumerate(share['Year'])],
+                                        direction='down',
+                                        showactive=True,
+                                        x=0.95,  # Position of the dropdown menu on the x-axis
+                                        xanchor='right',  # Align dropdown menu to the right
+                                        y=0.05,  # Position of the dropdown menu on the y-axis
+                                        yanchor='bottom')])
+    return fig1_bar
 # === End Code ===
 
+# Source CSV of every home page figure; a changed CSV only rebuilds its own figure
+home_figure_sources = {
+    'consump_fig': ('Consumption CO2 Philippines.csv', build_consumption_figure),
+    'fig_gen': ('Electricity generation by source Philippines.csv', build_generation_figure),
+    'fig1_bar': ('Energy Share in the Philippines.csv', build_share_figure),
+}
+
+def load_home_figure(name):
+    file_name, build_figure = home_figure_sources[name]
+    return build_figure(pd.read_csv(dataset_folder / file_name))
+
+# Serialized and compressed once, then fetched by the home page from their cached URLs (static_figures.py)
+home_figures = StaticFigureStore()
+for name in home_figure_sources:
+    home_figures.put(name, load_home_figure(name))
+# Graph id on the home page -> figure
+home_graphs = {'consump_gofig': 'consump_fig', 'gen_gofig': 'fig_gen', 'pie1_share': 'fig1_bar'}
+register_figure_route(app.server, home_figures)
+# Payload size of every home figure per encoding on /metrics
+registry.add_collector(lambda: [('home_figure_bytes', {'figure': name, 'encoding': encoding}, size)
+                                for (name, encoding), size in home_figures.sizes().items()])
+
 # === Supplementary Dropdown code ===
-solar_options = []
-for i in gadm_data_with_group.columns[17:]:
-    solar_options.append({
-        'label': i, 
-        'value': i
-    })
-location_options = [{'label': location, 'value': location} for location in gadm_data_with_dropdup_group['NAME_2'].unique()]
+# solar_options and location_options come with the geodata (load_geodata)
+aggregates = {
+    'max': 'Maximum',
+    'mean': 'Mean',
+    'p50': 'Median',
+    'p25': '25th Percentile',
+    'p75': '75th Percentile',
+    'p90': '90th Percentile',
+    'min': 'Minimum',
+    'sum': 'Total',
+    'count': 'Number of Buildings',
+}
+aggregate_options = [{'label': label, 'value': statistic} for statistic, label in aggregates.items()]
+
+# What-if sliders of the choropleth page (scenarios.py); the efficiency starts at the one implied by the data
+def scenario_controls():
+    efficiency = scenario_engine.baseline_efficiency
+    percent_marks = {value: f'{value}%' for value in range(0, 101, 25)}
+    sliders = [
+        html.H6('Scenario'),
+        html.P('Panel efficiency (%)'),
+        dcc.Slider(id='efficiency-slider', min=min(10, np.floor(efficiency)), max=max(25, np.ceil(efficiency)), step=0.5,
+                   value=efficiency, marks={value: f'{value}%' for value in range(10, 26, 5)}, tooltip={'placement': 'bottom'}),
+        html.P('Yearly degradation (%)'),
+        dcc.Slider(id='degradation-slider', min=0, max=2, step=0.1, value=0.5, marks={0: '0%', 1: '1%', 2: '2%'},
+                   tooltip={'placement': 'bottom'}),
+        html.P('Years of operation'),
+        dcc.Slider(id='years-slider', min=0, max=25, step=1, value=0, marks={value: str(value) for value in range(0, 26, 5)},
+                   tooltip={'placement': 'bottom'}),
+    ]
+    for category in scenario_engine.categories:
+        sliders += [
+            html.P(f'Adoption rate, {category} buildings (%)'),
+            dcc.Slider(id={'type': 'adoption-slider', 'index': category}, min=0, max=100, step=5, value=100,
+                       marks=percent_marks, tooltip={'placement': 'bottom'}),
+        ]
+    return sliders
 
 #=== Cluster Map ===
-geolocator = Nominatim(user_agent="dash-reverse-geocoder")
-fig = px.scatter_mapbox(converted_gdf_indexed, 
-                        lat=converted_gdf_indexed.geometry.centroid.y,
-                        lon=converted_gdf_indexed.geometry.centroid.x,
-                        hover_name="b_type",
-                        color="b_type",
-                        zoom=11,
-                        height=1500,
-                        width=1000)
-fig.update_traces(cluster=dict(enabled=True))
+# The reverse geocoder and cluster index come with the geodata (load_geodata)
+cluster_map_center = {"lat": 14.61, "lon": 121.0}
+cluster_map_zoom = 11
+# Map layers drawn from the vector tiles (vector_tiles.py), so the payload depends on the viewport only
+vector_tile_styles = {
+    'provinces': dict(type='line', color='#666666', line=dict(width=1)),
+    'barangays': dict(type='line', color='#888888', line=dict(width=0.5)),
+    'buildings': dict(type='fill', color='#4477AA', opacity=0.4),
+}
+
+def vector_tile_layers():
+    # A TileJSON URL rather than the tile template, so Mapbox knows the tiles stop at MAX_ZOOM and overzooms
+    # them; the layers cut up to MAX_ZOOM stay visible to the deepest map zoom
+    base_url = request.host_url.rstrip('/') if has_request_context() else ''
+    source = tile_source.tilejson_url(base_url)
+    return [dict(sourcetype='vector', source=source, sourcelayer=layer.name, below='traces', minzoom=layer.min_zoom,
+                 maxzoom=MAP_MAX_ZOOM if layer.max_zoom >= MAX_ZOOM else layer.max_zoom + 1, **vector_tile_styles[layer.name])
+            for layer in tile_source.layers]
+
+def build_cluster_map(relayout_data):
+    zoom, bounds = viewport_from_relayout(relayout_data, cluster_map_center, cluster_map_zoom)
+    visible = cluster_index.query(zoom, bounds)
+    is_point = visible['point_id'] >= 0
+    fig = go.Figure()
+    # Single buildings keep their building-type colour; customdata carries the row for display_click_data
+    for code, b_type in enumerate(cluster_index.category_labels):
+        selected = is_point & (visible['category'] == code)
+        fig.add_trace(go.Scattermapbox(
+            lat=visible['lat'][selected],
+            lon=visible['lon'][selected],
+            customdata=visible['point_id'][selected],
+            mode='markers',
+            marker=dict(size=9, color=px.colors.qualitative.Plotly[code % len(px.colors.qualitative.Plotly)]),
+            name=b_type,
+            hovertext=[b_type] * int(selected.sum()),
+            hoverinfo='text'
+        ))
+    clusters = ~is_point
+    fig.add_trace(go.Scattermapbox(
+        lat=visible['lat'][clusters],
+        lon=visible['lon'][clusters],
+        customdata=visible['point_id'][clusters],
+        mode='markers+text',
+        marker=dict(size=14 + 6 * np.log10(visible['count'][clusters]), color='#4477AA', opacity=0.8),
+        text=visible['count'][clusters],
+        textfont=dict(color='white'),
+        name='Clusters',
+        hovertemplate='%{text} buildings<extra></extra>'
+    ))
+    fig.update_layout(
+        mapbox=dict(accesstoken=mapbox_token, center=cluster_map_center, zoom=cluster_map_zoom,
+                    layers=vector_tile_layers()),
+        # Keep the user's pan/zoom when the clusters for a new viewport come in
+        uirevision='cluster-map',
+        height=1500,
+        width=1000,
+        legend_title_text='b_type'
+    )
+    return fig
 #=== End Cluster Map ===
 
 # Definining layout
@@ -297,6 +500,7 @@ app.layout = html.Div(style={'background-image': 'url("/assets/solar.png")',
      Input("building-locator-link", "n_clicks"),
      Input("choropleth-locator-link", "n_clicks")]
 )
+@instrument_callback('render_content')
 def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
     ctx = dash.callback_context
     if not ctx.triggered:
@@ -305,6 +509,7 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
         tab_id = ctx.triggered[0]["prop_id"].split(".")[0]
     if tab_id == "home-link":
         return html.Div(children=[
+            dcc.Store(id='home-figure-urls', data=[home_figures.url(name) for name in home_graphs.values()]),
             html.Div(children=[
                 dbc.Row(children=[
                   dbc.Col(html.H6('''Solar energy is a renewable source of electricity derived from the sun's radiation.
@@ -322,7 +527,7 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
             html.Div(style={'margin-top': '40px'}, children=[
                 dbc.Row(children=[
                     dbc.Col(children=[
-                        dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='consump_gofig',figure=consump_fig, responsive=True))
+                        dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='consump_gofig', responsive=True))
                     ],style={'width': '50%', 'display': 'inline-block', 'float': 'left'}),
                     dbc.Col(children=[
                         html.H3('Electricity Consumption and CO2 Emissions in the PH'),
@@ -345,14 +550,14 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
                         transitioning to cleaner energy sources are crucial for mitigating impacts and building resilience. ''')
                     ],style={'background-color': 'rgba(50,50,50,0.5)', 'width': '50%', 'display': 'inline-block', 'float': 'left', 'color': 'white'}),
                     dbc.Col(children=[
-                        dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='gen_gofig',figure=fig_gen, responsive=True)),
+                        dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='gen_gofig', responsive=True)),
                     ],style={'width': '50%', 'display': 'inline-block', 'float': 'right'}),
                 ]),
             ]),
             html.Div(style={'margin-top': '40px'}, children=[
                 dbc.Row(children=[
                      dbc.Col(children=[
-                            dcc.Loading(id="map-loading", children=dcc.Graph(id='pie1_share',figure=fig1_bar, responsive=True)),
+                            dcc.Loading(id="map-loading", children=dcc.Graph(id='pie1_share', responsive=True)),
                     ],style={'width': '50%', 'height':'50%', 'display': 'inline-block', 'float': 'left'}),
                     dbc.Col(children=[
                         html.H3('Energy Generation Share in the PH'),
@@ -384,7 +589,7 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
            ],justify="center"),
             dbc.Row(children=[
                 dbc.Col(children=[
-                   dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='cluster-map', figure=fig, responsive=True)),
+                   dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='cluster-map', responsive=True)),
                ],align="center", style={'display': 'inline-block'}),
             ], justify="center"),
              dbc.Row(children=[
@@ -394,6 +599,8 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
             ], justify="center"),
             ])
     elif tab_id == "choropleth-locator-link":
+        # The dropdown options come from the geodata
+        ensure_geodata()
         return html.Div(children=[
             dbc.Row(children=[
                 html.H3('Choropleth Map Locator', style={'text-align': 'center', 'background-color': 'rgba(50,50,50,0.5)', 'color': 'white'}),
@@ -413,6 +620,19 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
             options=solar_options,
             value=solar_options[0]['value']
         )
+           ],align="center",style={'margin': '20px'}),
+             dbc.Row(children=[
+            dcc.Dropdown(
+            id='aggregate-dropdown',
+            options=aggregate_options,
+            value=aggregate_options[0]['value'],
+            clearable=False
+        )
+           ],align="center",style={'margin': '20px'}),
+             dbc.Row(children=scenario_controls(),
+                     style={'margin': '20px', 'padding': '10px', 'background-color': 'rgba(50,50,50,0.5)', 'color': 'white'}),
+             dbc.Row(children=[
+                html.H6(id='scenario-summary', style={'text-align': 'center', 'color': 'white', 'background-color': 'rgba(50,50,50,0.5)'}),
            ],align="center",style={'margin': '20px'}),
              dbc.Row(children=[
             dcc.Dropdown(
@@ -430,7 +650,9 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
                 dbc.Container(children=[
                     dbc.Row(children=[
                         dbc.Col(children=[
-                            dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='left-graph', responsive=True))
+                            dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='left-graph', responsive=True)),
+                            # GeoJSON URL the left graph currently shows, so a pan within a level fetches nothing
+                            dcc.Store(id='left-graph-geojson')
                        ], style={'width': '49%', 'display': 'inline-block', 'float': 'left'}),
                         dbc.Col(children=[
                            dcc.Loading(id="map-loading", type="cube", children=dcc.Graph(id='right-graph', responsive=True))
@@ -441,22 +663,38 @@ def render_content(home_clicks, building_types_clicks, choropleth_map_clicks):
 
     ])
     
+# The home figures are not part of the layout: the browser fetches their pre-serialized, compressed
+# JSON from the cached /figures URLs (a repeat visit is served from its cache)
+app.clientside_callback(
+    """
+    function(urls) {
+        return Promise.all(urls.map(url => fetch(url).then(response => response.json())));
+    }
+    """,
+    [Output(graph_id, 'figure') for graph_id in home_graphs],
+    Input('home-figure-urls', 'data')
+)
+
 @app.callback(
     Output('potential-info', 'children'),
     [Input('cluster-map', 'clickData')]
 )
+@instrument_callback('display_click_data')
+@uses_geodata
 def display_click_data(clickData):
-    print("Clicked data:", clickData)
+    logger.debug('Clicked data: %s', clickData)
     if clickData is not None:
-        # Get the index of the clicked point
-        point_index = clickData['points'][0]['pointIndex']
+        # Get the building row of the clicked point; clusters carry -1
+        point_index = clickData['points'][0].get('customdata', -1)
         lat = clickData['points'][0]['lat']
         lon = clickData['points'][0]['lon']
-        location = geolocator.reverse((lat, lon))
+        if point_index < 0:
+            return html.P('Zoom in on the cluster to select a single building.')
+        location = geolocator.reverse(lat, lon)
         # Get the corresponding potential value from your data
-        potential_value = converted_gdf_indexed.iloc[point_index]['potential']
-        capacity_value = converted_gdf_indexed.iloc[point_index]['capacity']
-        suitarea_value = converted_gdf_indexed.iloc[point_index]['capacity']
+        potential_value = buildings.metrics['potential'][point_index]
+        capacity_value = buildings.metrics['capacity'][point_index]
+        suitarea_value = buildings.metrics['suitarea'][point_index]
         # Display the potential value
 
         return html.Div([
@@ -469,23 +707,42 @@ def display_click_data(clickData):
     
     else:
         return html.P('Information will be display here once a data point is clicked.'),
-    
+
 @app.callback(
-    Output('left-graph', 'figure'),
-    [Input('solar-dropdown', 'value')],
-    [Input('location-filter', 'value')]
+    Output('cluster-map', 'figure'),
+    [Input('cluster-map', 'relayoutData')]
 )
-#Bottom left graph
-def update_left_graph(selected_option,selected_location):
-    filtered_data = gadm_data_with_group[gadm_data_with_group['NAME_2'] == selected_location]
+@instrument_callback('update_cluster_map')
+@uses_geodata
+def update_cluster_map(relayoutData):
+    with measure('dash_figure_build_seconds', figure='cluster-map'):
+        return build_cluster_map(relayoutData)
+    
+# Figure builders for the choropleth page; each takes the rows of the selected city only
+def location_view(selected_location):
+    # Center and zoom that fit the city's regions, the cluster map's default view for no city
+    bounds = region_geometry.bounds(selected_location)
+    if bounds is None:
+        return cluster_map_center, cluster_map_zoom
+    return view_for_bounds(bounds)
+
+def left_graph_geojson(selected_location, zoom=None):
+    # URL of the simplified polygons for a zoom, by default the one the city opens at
+    if zoom is None:
+        _, zoom = location_view(selected_location)
+    return region_geometry.url(selected_location, region_geometry.level_for_zoom(zoom))
+
+def build_left_graph(selected_option, selected_location, filtered_data):
+    center, zoom = location_view(selected_location)
+    # The polygons are fetched by the browser from the pre-serialized, simplified GeoJSON route
     fig = px.choropleth_mapbox(
         filtered_data,
-        geojson=filtered_data.geometry,
-        locations=filtered_data.index,
+        geojson=left_graph_geojson(selected_location, zoom),
+        locations=filtered_data.index.astype(str),
         color=selected_option,
         mapbox_style="carto-positron",
-        center={"lat": 14.61, "lon": 121.0},
-        zoom=11,
+        center=center,
+        zoom=zoom,
         opacity=0.8,
         color_continuous_scale="Viridis",
         labels={selected_option: selected_option},
@@ -494,25 +751,18 @@ def update_left_graph(selected_option,selected_location):
         height=700
     )
     fig.update_layout(
-        title='Max Capacity Distribution per NAME_3',
-        margin={"r": 0, "t": 0, "l": 0, "b": 0}
+        title=selected_option + ' per NAME_3',
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        # Keep the user's zoom when the geometry level is swapped, reset it on a new city
+        uirevision=selected_location
     )
     return fig
 
-# Bottom right graph
-@app.callback(
-    Output('right-graph', 'figure'),
-    [Input('solar-dropdown', 'value')],
-    [Input('location-filter', 'value')]
-)
-def update_right_graph(selected_option,selected_location):
-    filtered_data = merged_data[merged_data['NAME_2'] == selected_location]
-    scatter_data = filtered_data.explode().reset_index()  
-    scatter_data['centroid_lon'] = scatter_data.geometry.centroid.x
-    scatter_data['centroid_lat'] = scatter_data.geometry.centroid.y
-
+def build_right_graph(selected_option, selected_location, filtered_data):
+    center, zoom = location_view(selected_location)
+    # Centroids are precomputed per building in geodata_cache.py
     fig = px.scatter_mapbox(
-        scatter_data,
+        filtered_data,
         lat='centroid_lat',
         lon='centroid_lon',
         color=selected_option,
@@ -523,25 +773,246 @@ def update_right_graph(selected_option,selected_location):
     )
     fig.update_layout(
         mapbox_style="carto-positron",
-        mapbox_zoom=11,
-        mapbox_center={"lat": 14.61, "lon": 121.0},
+        mapbox_zoom=zoom,
+        mapbox_center=center,
         coloraxis_colorbar=dict(title=selected_option),
         margin=dict(l=0, r=0, t=0, b=0)
     )
     return fig
 
-@app.callback(
-    Output('bar-chart', 'figure'),
-    [Input('solar-dropdown', 'value')],
-    [Input('location-filter', 'value')]
-)
-def update_bar_chart(selected_name,location_options):
-    filtered_data = gadm_data_with_dropdup_group[gadm_data_with_dropdup_group['NAME_2'] == location_options]
+def build_bar_chart(selected_name, selected_location, filtered_data):
     filtered_data_sorted = filtered_data.sort_values(by=selected_name, ascending=False).head(20)
     fig = px.bar(filtered_data_sorted, x='NAME_3', y=selected_name, title=str(selected_name) + str(" By Area"), color='NAME_3')
     fig.update_layout(xaxis_title='Area', yaxis_title=str(selected_name))
     return fig
 
+metric_names = {label: metric for metric, label in METRIC_COLUMNS.items()}
+
+def aggregate_column(selected_option, selected_aggregate):
+    if selected_aggregate == 'count':
+        return aggregates['count']
+    return aggregates[selected_aggregate] + ' ' + selected_option
+
+def region_aggregates(regions, selected_option, selected_aggregate, scenario):
+    # GADM rows of one city with the chosen aggregate of the metric looked up in the scenario's cube
+    column = aggregate_column(selected_option, selected_aggregate)
+    values = scenario_engine.cube_for(scenario).lookup('NAME_3', regions, metric_names[selected_option], selected_aggregate)
+    return regions.assign(**{column: values}), column
+
+def location_regions(selected_option, selected_aggregate, selected_location, scenario):
+    return region_aggregates(gadm_data_with_group_by_location.get(selected_location), selected_option, selected_aggregate, scenario)
+
+def location_areas(selected_option, selected_aggregate, selected_location, scenario):
+    return region_aggregates(gadm_data_with_dropdup_group_by_location.get(selected_location), selected_option, selected_aggregate, scenario)
+
+def location_buildings(selected_option, selected_aggregate, selected_location, scenario):
+    rows = buildings.partition(selected_location)
+    frame = buildings.frame(rows, METRIC_COLUMNS)
+    if scenario != scenario_engine.baseline:
+        for metric, label in METRIC_COLUMNS.items():
+            frame[label] = scenario_engine.values(scenario, metric, rows)
+    return frame, selected_option
+
+# graph id -> (figure builder, function returning the rows of one city and the column to plot,
+#              whether the figure depends on the selected aggregate)
+choropleth_page_figures = {
+    'left-graph': (build_left_graph, location_regions, True),
+    'right-graph': (build_right_graph, location_buildings, False),
+    'bar-chart': (build_bar_chart, location_areas, True),
+}
+
+def build_choropleth_page(selected_option, selected_aggregate, selected_location, graph_ids, scenario=None):
+    scenario = scenario or scenario_engine.baseline
+    figures = {}
+    for graph_id in graph_ids:
+        build_figure, select_rows, _ = choropleth_page_figures[graph_id]
+        with measure('dash_figure_build_seconds', figure=graph_id):
+            rows, column = select_rows(selected_option, selected_aggregate, selected_location, scenario)
+            figures[graph_id] = build_figure(column, selected_location, rows)
+    return figures
+
+def figure_cache_key(selected_option, selected_aggregate, selected_location, graph_id):
+    uses_aggregate = choropleth_page_figures[graph_id][2]
+    return selected_option, selected_aggregate if uses_aggregate else None, selected_location, graph_id
+
+# Sliders whose change recolours the maps like a new metric does
+scenario_inputs = ['efficiency-slider', 'degradation-slider', 'years-slider']
+
+# Bottom left choropleth, bottom right scatter map, the bar chart and the scenario total share one round-trip
+@app.callback(
+    [Output('left-graph', 'figure'),
+     Output('right-graph', 'figure'),
+     Output('bar-chart', 'figure'),
+     Output('scenario-summary', 'children')],
+    [Input('solar-dropdown', 'value'),
+     Input('aggregate-dropdown', 'value')],
+    [Input('location-filter', 'value')],
+    [Input('efficiency-slider', 'value'),
+     Input('degradation-slider', 'value'),
+     Input('years-slider', 'value'),
+     Input({'type': 'adoption-slider', 'index': ALL}, 'value')],
+    [State({'type': 'adoption-slider', 'index': ALL}, 'id')]
+)
+@instrument_callback('update_choropleth_page')
+@uses_geodata
+def update_choropleth_page(selected_option, selected_aggregate, selected_location, efficiency, degradation, years,
+                           adoption_rates, adoption_ids):
+    ctx = dash.callback_context
+    selected_location = parse_location(selected_location)
+    adoption = {slider['index']: rate for slider, rate in zip(adoption_ids, adoption_rates)}
+    scenario = scenario_engine.scenario(efficiency, adoption, degradation, years)
+    summary = scenario_summary(selected_option, selected_location, scenario)
+    bar_chart = lambda: cached_choropleth_page(selected_option, selected_aggregate, selected_location, ['bar-chart'], scenario)['bar-chart']
+    if ctx.triggered_id == 'solar-dropdown' or ctx.triggered_id in scenario_inputs or isinstance(ctx.triggered_id, dict):
+        # Only the values changed: keep the polygons and points, send just the new colour values
+        left_patch, right_patch = metric_patches(selected_option, selected_aggregate, selected_location, scenario)
+        return left_patch, right_patch, bar_chart(), summary
+    if ctx.triggered_id == 'aggregate-dropdown':
+        # The building points do not depend on the aggregate
+        return aggregate_patch(selected_option, selected_aggregate, selected_location, scenario), dash.no_update, bar_chart(), summary
+    figures = cached_choropleth_page(selected_option, selected_aggregate, selected_location, list(choropleth_page_figures), scenario)
+    return figures['left-graph'], figures['right-graph'], figures['bar-chart'], summary
+
+@lru_cache(maxsize=1024)
+def scenario_summary(selected_option, selected_location, scenario):
+    # City total of the metric (NAME_2 sum) under the scenario, against the estimates of the data;
+    # cleared with the figure cache when the geodata is reloaded
+    if selected_location is None:
+        return ''
+    metric = metric_names[selected_option]
+    name_1, name_2 = selected_location
+    totals = []
+    for cube in (aggregation_cube, scenario_engine.cube_for(scenario)):
+        cities = cube.table('NAME_2', metric, 'sum')
+        totals.append(cities.loc[(cities['NAME_1'] == name_1) & (cities['NAME_2'] == name_2), 'value'].sum())
+    summary = f'Total {selected_option} in {location_label(selected_location)}: {totals[1]:,.0f}'
+    if scenario != scenario_engine.baseline and totals[0]:
+        summary += f' ({(totals[1] / totals[0] - 1) * 100:+.1f}% from the estimates)'
+    return summary
+
+def cached_choropleth_page(selected_option, selected_aggregate, selected_location, graph_ids, scenario):
+    if scenario != scenario_engine.baseline:
+        # Scenario figures are built each time so that dragging a slider does not evict the cached views
+        return build_choropleth_page(selected_option, selected_aggregate, selected_location, graph_ids, scenario)
+    keys = {graph_id: figure_cache_key(selected_option, selected_aggregate, selected_location, graph_id) for graph_id in graph_ids}
+    figures = {graph_id: figure_cache.get(key) for graph_id, key in keys.items()}
+    missing = [graph_id for graph_id, figure in figures.items() if figure is None]
+    if missing:
+        for graph_id, figure in build_choropleth_page(selected_option, selected_aggregate, selected_location, missing).items():
+            figure_cache.put(keys[graph_id], figure)
+            figures[graph_id] = figure
+    return figures
+
+@lru_cache(maxsize=None)
+def metric_hovertemplates(selected_option, selected_aggregate):
+    # Built from empty frames so the hover text always matches what the figure builders produce
+    figures = build_choropleth_page(selected_option, selected_aggregate, None, ['left-graph', 'right-graph'])
+    return figures['left-graph'].data[0].hovertemplate, figures['right-graph'].data[0].hovertemplate
+
+def aggregate_patch(selected_option, selected_aggregate, selected_location, scenario):
+    left_hovertemplate, _ = metric_hovertemplates(selected_option, selected_aggregate)
+    regions, column = location_regions(selected_option, selected_aggregate, selected_location, scenario)
+    left_patch = Patch()
+    left_patch['data'][0]['z'] = regions[column].to_numpy()
+    left_patch['data'][0]['hovertemplate'] = left_hovertemplate
+    left_patch['layout']['coloraxis']['colorbar']['title']['text'] = column
+    return left_patch
+
+def metric_patches(selected_option, selected_aggregate, selected_location, scenario):
+    _, right_hovertemplate = metric_hovertemplates(selected_option, selected_aggregate)
+    left_patch = aggregate_patch(selected_option, selected_aggregate, selected_location, scenario)
+    right_patch = Patch()
+    right_patch['data'][0]['marker']['color'] = scenario_engine.values(scenario, metric_names[selected_option], buildings.partition(selected_location))
+    right_patch['data'][0]['hovertemplate'] = right_hovertemplate
+    right_patch['layout']['coloraxis']['colorbar']['title']['text'] = selected_option
+    return left_patch, right_patch
+
+# Swap the choropleth polygons for the simplification level that fits the new zoom; a new city
+# resets the tracked URL to the one its figure opens with
+@app.callback(
+    [Output('left-graph', 'figure', allow_duplicate=True),
+     Output('left-graph-geojson', 'data')],
+    [Input('left-graph', 'relayoutData'),
+     Input('location-filter', 'value')],
+    [State('left-graph-geojson', 'data')],
+    prevent_initial_call=True
+)
+@instrument_callback('update_left_graph_level')
+@uses_geodata
+def update_left_graph_level(relayoutData, selected_location, current_geojson):
+    selected_location = parse_location(selected_location)
+    if dash.callback_context.triggered_id == 'location-filter':
+        return dash.no_update, left_graph_geojson(selected_location)
+    zoom = (relayoutData or {}).get('mapbox.zoom')
+    if zoom is None:
+        return dash.no_update, dash.no_update
+    geojson = left_graph_geojson(selected_location, zoom)
+    if geojson == current_geojson:
+        # Same simplification level: the browser already has these polygons
+        return dash.no_update, dash.no_update
+    patched_figure = Patch()
+    patched_figure['data'][0]['geojson'] = geojson
+    return patched_figure, geojson
+
+# Figure cache hit/miss counters
+@app.server.route('/figure-cache/stats')
+def figure_cache_stats():
+    return jsonify(figure_cache.stats())
+
+registry.add_collector(lambda: [('figure_cache_' + name, {}, value) for name, value in figure_cache.stats().items()])
+
+# Prebuild the most viewed choropleth states (default metric in the largest cities)
+def warm_up_figure_cache(location_count):
+    selected_option = solar_options[0]['value']
+    selected_aggregate = aggregate_options[0]['value']
+    with data_lock.reading():
+        locations = buildings.locations()[:location_count]
+    for location in locations:
+        with data_lock.reading():
+            for graph_id, figure in build_choropleth_page(selected_option, selected_aggregate, location, choropleth_page_figures).items():
+                figure_cache.put(figure_cache_key(selected_option, selected_aggregate, location, graph_id), figure)
+
+# Load the geodata and prebuild the cache in a background thread so the first map visit does not wait
+# for them (GEODATA_PRELOAD=0 leaves the loading to that first visit, without the warm-up)
+def preload_geodata():
+    ensure_geodata()
+    if figure_cache_warmup > 0:
+        warm_up_figure_cache(figure_cache_warmup)
+
+if os.environ.get('GEODATA_PRELOAD', '1') == '1':
+    threading.Thread(target=preload_geodata, name='geodata-preload', daemon=True).start()
+
+# === Data refresh ===
+# Changed dataset files are picked up without a restart: a CSV rebuilds its own home figure,
+# the building GeoJSON or GADM shapefile rebuilds the geodata, which is then swapped in at once
+def reload_home_figure(name):
+    # The new figure gets a new URL, so the next home page render fetches it
+    home_figures.put(name, load_home_figure(name))
+
+def reload_geodata():
+    with geodata_load_lock:
+        if not geodata_loaded.is_set():
+            # Not loaded yet: the first use will read the new files anyway
+            return
+        geodata = load_geodata()
+        with data_lock.swapping():
+            install_geodata(geodata)
+            figure_cache.clear()
+            scenario_summary.cache_clear()
+    if figure_cache_warmup > 0:
+        warm_up_figure_cache(figure_cache_warmup)
+
+# Seconds between checks of the dataset folder (0 disables the reload)
+data_reload_interval = float(os.environ.get('DATA_RELOAD_INTERVAL', '5'))
+if data_reload_interval > 0:
+    dataset_watcher = DatasetWatcher(data_reload_interval)
+    for name, (file_name, _) in home_figure_sources.items():
+        dataset_watcher.watch([dataset_folder / file_name], partial(reload_home_figure, name))
+    # A new building batch is appended to the cache; the other changes rebuild it
+    dataset_watcher.watch([dataset_folder / name for name in SOURCE_FILES] + [dataset_folder / BATCH_FOLDER], reload_geodata)
+    dataset_watcher.start()
+#=== End Data refresh ===
+
 # Run the app
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,264 @@
+"""Benchmark the dashboard startup pipeline and callbacks on synthetic data.
+
+For every requested size a workspace is created with a synthetic
+``solar_data.geojson`` inside the real GADM Metro Manila polygons (plus the
+real CSVs and shapefile), and a fresh Python process imports ``app.py`` there
+and times:
+
+* the startup pipeline phases (read, to_crs, sjoin, groupby), cold, and the
+  warm start from the geodata cache,
+* every callback, with the size of its serialized response.
+
+Results are written as JSON.  ``--compare`` checks them against an earlier
+run and exits non-zero when a timing got slower than ``--threshold`` times
+the baseline, so it can gate a deploy.
+
+    python benchmarks/bench_app.py --sizes 10000 100000 --output bench.json
+    python benchmarks/bench_app.py --sizes 10000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def timed(function, *args, repeat=1):
+    """Run ``function`` ``repeat`` times; return its last result and the median seconds."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        durations.append(time.perf_counter() - start)
+    return result, statistics.median(durations)
+
+
+# === Workspace ===
+def prepare_workspace(workspace, size, seed):
+    import geopandas as gpd
+    from synthetic import generate_buildings, write_buildings
+
+    datasets = workspace / 'datasets'
+    datasets.mkdir(parents=True, exist_ok=True)
+    for source in (REPO_ROOT / 'datasets').iterdir():
+        if source.name in ('solar_data.geojson', 'cache'):
+            continue
+        target = datasets / source.name
+        if not target.exists():
+            target.symlink_to(source, target_is_directory=source.is_dir())
+    for name in ('.mapbox_token', 'assets'):
+        if not (workspace / name).exists():
+            (workspace / name).symlink_to(REPO_ROOT / name)
+
+    gadm_data = gpd.read_file(datasets / 'gadm41_PHL_shp/gadm41_PHL_3.shp')
+    regions = gadm_data.query("NAME_1 == 'Metropolitan Manila'")
+    write_buildings(generate_buildings(regions, size, seed), datasets / 'solar_data.geojson')
+
+
+# === Worker (runs inside the workspace) ===
+def set_triggered(prop_id, value=None):
+    # Lets callbacks that read dash.callback_context run outside a request.
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+    context_value.set(AttributeDict(triggered_inputs=[{'prop_id': prop_id, 'value': value}]))
+
+
+def response_size(output):
+    import plotly
+    return len(json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder).encode())
+
+
+def bench_startup(dataset_folder):
+    import geopandas as gpd
+    import geodata_cache
+    from ingest import area_of_interest, read_buildings
+
+    phases = {}
+    gadm_data, phases['read_gadm'] = timed(gpd.read_file, dataset_folder / geodata_cache.GADM_FILE)
+    bbox, bbox_crs = area_of_interest(gadm_data, geodata_cache.REGION_QUERY)
+    solar_data, phases['read_buildings'] = timed(lambda: read_buildings(dataset_folder / geodata_cache.SOLAR_FILE,
+                                                                        bbox=bbox, bbox_crs=bbox_crs))
+    converted_gdf, phases['to_crs'] = timed(geodata_cache.prepare_buildings, solar_data)
+    merged_data, phases['sjoin'] = timed(lambda: geodata_cache.region_assigner(gadm_data).assign(converted_gdf)
+                                         .rename(columns=geodata_cache.METRIC_COLUMNS))
+    metrics = list(geodata_cache.METRIC_COLUMNS.values())
+    max_group, phases['groupby'] = timed(lambda: merged_data.groupby('NAME_3')[metrics].max().reset_index())
+    _, phases['group_regions'] = timed(geodata_cache.group_regions, gadm_data, merged_data, max_group)
+    _, phases['cache_build'] = timed(lambda: geodata_cache.load_artifacts(dataset_folder, force=True))
+    _, phases['cache_load'] = timed(geodata_cache.load_artifacts, dataset_folder)
+    return phases, len(solar_data)
+
+
+def bench_callbacks(app, repeat):
+    metrics = [option['value'] for option in app.solar_options]
+    aggregates = [option['value'] for option in app.aggregate_options]
+    location = app.location_value(app.buildings.locations()[0])
+    # Slider values of the estimates: efficiency, degradation, years, adoption per building type
+    categories = app.scenario_engine.categories
+    scenario = (app.scenario_engine.baseline_efficiency, 0.5, 0, [100] * len(categories),
+                [{'type': 'adoption-slider', 'index': category} for category in categories])
+    results = {}
+
+    def record(name, function, *args, trigger='.'):
+        set_triggered(trigger)
+        output, seconds = timed(function, *args, repeat=repeat)
+        results[name] = {'seconds': seconds, 'bytes': response_size(output)}
+        return output
+
+    for link in ('home-link', 'building-locator-link', 'choropleth-locator-link'):
+        record(f'render_content[{link}]', app.render_content, 0, 1, 2, trigger=f'{link}.n_clicks')
+    # The home figures are fetched by the browser from their own compressed route
+    client = app.server.test_client()
+    for name in app.home_graphs.values():
+        response, seconds = timed(lambda: client.get(app.home_figures.url(name), headers={'Accept-Encoding': 'br, gzip'}),
+                                  repeat=repeat)
+        results[f'home_figure[{name}]'] = {'seconds': seconds, 'bytes': len(response.data)}
+
+    # The figure cache would turn every repeat into a hit; time the cold build separately.
+    app.figure_cache.clear()
+    set_triggered('location-filter.value')
+    output, seconds = timed(app.update_choropleth_page, metrics[0], aggregates[0], location, *scenario)
+    results['update_choropleth_page[cold]'] = {'seconds': seconds, 'bytes': response_size(output)}
+    record('update_choropleth_page[cached]', app.update_choropleth_page, metrics[0], aggregates[0], location, *scenario,
+           trigger='location-filter.value')
+    record('update_choropleth_page[metric]', app.update_choropleth_page, metrics[-1], aggregates[0], location, *scenario,
+           trigger='solar-dropdown.value')
+    record('update_choropleth_page[aggregate]', app.update_choropleth_page, metrics[-1], aggregates[-1], location,
+           *scenario, trigger='aggregate-dropdown.value')
+    # A new parameter set each time, so no repeat is served from the scenario memo
+    efficiencies = iter(range(10, 10 + repeat))
+    record('update_choropleth_page[scenario]',
+           lambda: app.update_choropleth_page(metrics[-1], 'p50', location, next(efficiencies), 0.5, 10,
+                                              *scenario[3:]),
+           trigger='efficiency-slider.value')
+    record('update_left_graph_level', app.update_left_graph_level, {'mapbox.zoom': 14}, location, None,
+           trigger='left-graph.relayoutData')
+
+    record('update_cluster_map[initial]', app.update_cluster_map, None, trigger='cluster-map.relayoutData')
+    record('update_cluster_map[zoom 15]', app.update_cluster_map,
+           {'mapbox.zoom': 15, 'mapbox.center': {'lat': 14.58, 'lon': 121.0}}, trigger='cluster-map.relayoutData')
+
+    building = int(app.buildings.lat.argmax())
+    click = {'points': [{'customdata': building,
+                         'lat': float(app.buildings.lat[building]),
+                         'lon': float(app.buildings.lon[building])}]}
+    record('display_click_data', app.display_click_data, click, trigger='cluster-map.clickData')
+    return results
+
+
+def run_worker(repeat):
+    dataset_folder = Path('datasets')
+    startup, buildings = bench_startup(dataset_folder)
+    start = time.perf_counter()
+    sys.path.insert(0, str(REPO_ROOT))
+    import app
+    startup['import_app'] = time.perf_counter() - start
+    _, startup['load_geodata'] = timed(app.ensure_geodata)
+    callbacks = bench_callbacks(app, repeat)
+    return {'buildings': buildings, 'startup': startup, 'callbacks': callbacks}
+
+
+# === Driver ===
+def run_size(size, seed, repeat, keep):
+    workspace = Path(tempfile.mkdtemp(prefix=f'solar-bench-{size}-'))
+    try:
+        prepare_workspace(workspace, size, seed)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(REPO_ROOT), str(Path(__file__).parent)]),
+                   FIGURE_CACHE_WARMUP='0', DATA_RELOAD_INTERVAL='0',
+                   GEODATA_PRELOAD='0')
+        completed = subprocess.run([sys.executable, __file__, '--worker', '--repeat', str(repeat)],
+                                   cwd=workspace, env=env, capture_output=True, text=True, check=True)
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        if keep:
+            print(f'Workspace kept at {workspace}', file=sys.stderr)
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def collect_timings(results):
+    """Flatten a results document into {'size/section/name': seconds}."""
+    timings = {}
+    for size, result in results['results'].items():
+        for name, seconds in result['startup'].items():
+            timings[f'{size}/startup/{name}'] = seconds
+        for name, entry in result['callbacks'].items():
+            timings[f'{size}/callbacks/{name}'] = entry['seconds']
+    return timings
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """Print the ratio of every shared timing; return the names that regressed.
+
+    Timings that got slower by less than ``min_seconds`` are never counted,
+    so sub-millisecond noise does not fail the comparison.
+    """
+    current = collect_timings(results)
+    previous = collect_timings(baseline)
+    regressions = []
+    for name in sorted(set(current) & set(previous)):
+        ratio = current[name] / previous[name] if previous[name] else float('inf')
+        flag = ''
+        if ratio > threshold and current[name] - previous[name] > min_seconds:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:70s} {previous[name]:10.4f}s -> {current[name]:10.4f}s  x{ratio:5.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='numbers of synthetic buildings')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per callback, the median is reported')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio counted as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.005,
+                        help='ignore slowdowns smaller than this many seconds')
+    parser.add_argument('--keep', action='store_true', help='keep the generated workspaces')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.repeat)))
+        return
+
+    sys.path.insert(0, str(REPO_ROOT))
+    results = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                                     capture_output=True, text=True).stdout.strip(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': {},
+    }
+    for size in args.sizes:
+        print(f'Benchmarking {size} buildings...', file=sys.stderr)
+        results['results'][str(size)] = run_size(size, args.seed, args.repeat, args.keep)
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f'Results written to {args.output}', file=sys.stderr)
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold, args.min_seconds)
+        if regressions:
+            sys.exit(f'{len(regressions)} timing(s) regressed by more than x{args.threshold}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Synthetic building datasets for the benchmarks.
+
+Generates square building footprints at random positions inside the GADM
+Metro Manila polygons, with ``capacity``/``suitarea``/``potential``/``b_type``
+/``city`` attributes in plausible ranges, and writes them in the same shape
+as ``datasets/solar_data.geojson``.
+"""
+import numpy as np
+import geopandas as gpd
+import pyogrio
+import shapely
+
+B_TYPES = ['residential', 'commercial', 'industrial', 'institutional', 'mixed']
+B_TYPE_WEIGHTS = [0.7, 0.15, 0.05, 0.05, 0.05]
+PROJECTED_CRS = "EPSG:32651"
+
+
+def random_points_in(regions, n, rng, batch=200_000):
+    """Draw ``n`` points uniformly inside ``regions``; return lon, lat and region position."""
+    minx, miny, maxx, maxy = regions.total_bounds
+    tree = shapely.STRtree(np.asarray(regions.geometry.values))
+    lons, lats, owners = [], [], []
+    kept = 0
+    while kept < n:
+        lon = rng.uniform(minx, maxx, batch)
+        lat = rng.uniform(miny, maxy, batch)
+        point_index, region_index = tree.query(shapely.points(lon, lat), predicate='within')
+        # A point on a shared edge can match twice; keep its first region.
+        point_index, first = np.unique(point_index, return_index=True)
+        lons.append(lon[point_index])
+        lats.append(lat[point_index])
+        owners.append(region_index[first])
+        kept += len(point_index)
+    return np.concatenate(lons)[:n], np.concatenate(lats)[:n], np.concatenate(owners)[:n]
+
+
+def generate_buildings(regions, n, seed=0):
+    """Return a GeoDataFrame of ``n`` synthetic buildings inside ``regions`` (EPSG:4326)."""
+    rng = np.random.default_rng(seed)
+    regions = regions.to_crs("EPSG:4326").reset_index(drop=True)
+    lon, lat, owner = random_points_in(regions, n, rng)
+
+    centers = gpd.GeoSeries(shapely.points(lon, lat), crs="EPSG:4326").to_crs(PROJECTED_CRS)
+    x, y = centers.x.to_numpy(), centers.y.to_numpy()
+    half = rng.uniform(4, 20, n)
+    footprints = shapely.box(x - half, y - half, x + half, y + half)
+
+    roof_area = (2 * half) ** 2
+    suitarea = roof_area * rng.uniform(0.3, 0.9, n)
+    capacity = suitarea * 0.15
+    potential = capacity * rng.uniform(1100, 1500, n)
+    buildings = gpd.GeoDataFrame({
+        'capacity': capacity.round(2),
+        'suitarea': suitarea.round(2),
+        'potential': potential.round(1),
+        'b_type': rng.choice(B_TYPES, n, p=B_TYPE_WEIGHTS),
+        'city': regions['NAME_2'].to_numpy()[owner],
+    }, geometry=footprints, crs=PROJECTED_CRS)
+    # Footprints near a boundary may poke out of their region; that is fine,
+    # the real data has the same kind of buildings.
+    return buildings.to_crs("EPSG:4326")
+
+
+def write_buildings(buildings, path):
+    pyogrio.write_dataframe(buildings, path, driver='GeoJSON')
@@ -0,0 +1,390 @@
+"""REST API for bulk queries of the buildings, streamed as NDJSON or Arrow.
+
+The building potentials used to be reachable only through the UI callbacks.
+``/api/buildings`` answers queries from the building store directly:
+
+    GET  /api/buildings?bbox=121.0,14.5,121.1,14.6&b_type=residential&min_capacity=10
+    POST /api/buildings  {"polygon": {<GeoJSON geometry>}, "b_type": ["school"]}
+
+Filters, all optional and combined:
+
+* ``bbox`` (``minlon,minlat,maxlon,maxlat``) or ``polygon`` (GeoJSON
+  geometry, POST only): buildings whose centroid falls inside,
+* ``name_1``, ``name_2``, ``name_3``: GADM regions,
+* ``b_type``: one or more building types (repeated or comma separated),
+* ``min_<metric>``/``max_<metric>`` for capacity, suitarea and potential.
+
+POST takes the same keys in its JSON body.  Results come in store order, at
+most ``limit`` rows per page (``DEFAULT_LIMIT``, up to ``MAX_LIMIT``); when
+more match, the ``X-Next-Cursor`` header (also sent as a ``Link`` with
+``rel="next"``) is passed back as ``cursor`` for the next page.  A cursor
+names the store version, so paging across a data reload fails with 410
+instead of skipping rows.  ``format=arrow`` returns an Arrow IPC stream
+instead of NDJSON.
+
+Spatial filters go through a grid index of the centroids and a page is
+written in batches of ``BATCH_SIZE`` rows while it is sent, so exporting a
+whole city only ever holds row numbers and one batch in memory.
+"""
+import base64
+import io
+import json
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+
+from building_store import CATEGORIES, METRICS
+
+API_ROUTE = '/api/buildings'
+DEFAULT_LIMIT = 10_000
+MAX_LIMIT = 100_000
+BATCH_SIZE = 5_000
+FORMATS = {'ndjson': 'application/x-ndjson', 'arrow': 'application/vnd.apache.arrow.stream'}
+REGION_FILTERS = {'name_1': 'NAME_1', 'name_2': 'NAME_2', 'name_3': 'NAME_3'}
+# Grid cells are packed into one int64 key: (x + CELL_OFFSET) << 32 | (y + CELL_OFFSET)
+CELL_OFFSET = 1 << 30
+# Valid (minlon, minlat, maxlon, maxlat) of a bbox or polygon
+WORLD_BOUNDS = (-180.0, -90.0, 180.0, 90.0)
+
+
+class QueryError(ValueError):
+    """Invalid query parameters, reported to the client as 400."""
+
+
+class StaleCursor(Exception):
+    """Cursor issued for an earlier version of the data, reported to the client as 410."""
+
+
+class PointGridIndex:
+    """Grid of ``cell_size`` degree cells over the centroids, for box queries.
+
+    The rows are sorted by cell, column by column, so the cells of a box
+    are one contiguous run of the sorted rows per grid column.
+    """
+
+    def __init__(self, lon, lat, cell_size=0.01):
+        self.cell_size = cell_size
+        self.lon = lon
+        self.lat = lat
+        cell_x, cell_y = self._cells(lon), self._cells(lat)
+        keys = self._keys(cell_x, cell_y)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys_sorted = keys[self._order]
+        # Occupied cells, so a box only walks the grid columns that can hold rows
+        self._extent = (cell_x.min(), cell_y.min(), cell_x.max(), cell_y.max()) if len(keys) else None
+
+    def _cells(self, values):
+        return np.floor(np.asarray(values, dtype='float64') / self.cell_size).astype('int64')
+
+    @staticmethod
+    def _keys(cell_x, cell_y):
+        return ((cell_x + CELL_OFFSET) << 32) | (cell_y + CELL_OFFSET)
+
+    def query(self, bounds):
+        """Rows whose point lies in ``bounds`` (minlon, minlat, maxlon, maxlat), ascending."""
+        min_lon, min_lat, max_lon, max_lat = bounds
+        if self._extent is None:
+            return np.empty(0, dtype='int64')
+        min_x, min_y, max_x, max_y = self._extent
+        columns = np.arange(max(self._cells(min_lon), min_x), min(self._cells(max_lon), max_x) + 1)
+        low_y = np.clip(self._cells(min_lat), min_y, max_y)
+        high_y = np.clip(self._cells(max_lat), min_y, max_y)
+        starts = np.searchsorted(self._keys_sorted, self._keys(columns, low_y), side='left')
+        stops = np.searchsorted(self._keys_sorted, self._keys(columns, high_y), side='right')
+        lengths = stops - starts
+        if not lengths.sum():
+            return np.empty(0, dtype='int64')
+        # Concatenated aranges of every [start, stop) run
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        rows = self._order[positions]
+        lon = self.lon[rows]
+        lat = self.lat[rows]
+        rows = rows[(lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)]
+        return np.sort(rows)
+
+
+def _values(params, key):
+    value = params.get(key)
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        raise QueryError(f'{key} must be a string or a list of strings')
+    return [item.strip() for entry in value for item in str(entry).split(',') if item.strip()]
+
+
+def _single(params, key):
+    value = params.get(key)
+    if isinstance(value, (list, dict)):
+        raise QueryError(f'{key} must be given once')
+    return value
+
+
+def _number(params, key):
+    value = _single(params, key)
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise QueryError(f'{key} must be a number') from None
+    if np.isnan(number):
+        raise QueryError(f'{key} must be a number')
+    return number
+
+
+def _check_bounds(bounds, name):
+    """Raise QueryError unless ``bounds`` are finite lon/lat within ``WORLD_BOUNDS``."""
+    min_lon, min_lat, max_lon, max_lat = WORLD_BOUNDS
+    if not np.isfinite(bounds).all():
+        raise QueryError(f'{name} must have finite coordinates')
+    if bounds[0] < min_lon or bounds[2] > max_lon or bounds[1] < min_lat or bounds[3] > max_lat:
+        raise QueryError(f'{name} must lie within longitude -180..180 and latitude -90..90')
+
+
+def parse_query(args, body=None):
+    """Query of the request: the URL parameters ``args`` merged with a JSON ``body``.
+
+    Multi-valued URL parameters (``b_type=a&b_type=b``) are collected into lists.
+    """
+    params = {}
+    for key in args:
+        values = args.getlist(key) if hasattr(args, 'getlist') else [args[key]]
+        params[key] = values if len(values) > 1 else values[0]
+    if body is not None:
+        if not isinstance(body, dict):
+            raise QueryError('the request body must be a JSON object')
+        params.update(body)
+
+    query = {'regions': {}, 'ranges': {}}
+    bbox = _values(params, 'bbox')
+    if bbox:
+        try:
+            bbox = [float(value) for value in bbox]
+        except ValueError:
+            raise QueryError('bbox must be minlon,minlat,maxlon,maxlat') from None
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise QueryError('bbox must be minlon,minlat,maxlon,maxlat')
+        _check_bounds(bbox, 'bbox')
+        query['bbox'] = bbox
+    if params.get('polygon') is not None:
+        import shapely
+        from shapely.geometry import shape
+
+        try:
+            polygon = shape(params['polygon'])
+        except Exception:
+            raise QueryError('polygon must be a GeoJSON geometry') from None
+        if polygon.geom_type not in ('Polygon', 'MultiPolygon') or polygon.is_empty:
+            raise QueryError('polygon must be a GeoJSON Polygon or MultiPolygon')
+        _check_bounds(polygon.bounds, 'polygon')
+        shapely.prepare(polygon)
+        query['polygon'] = polygon
+    for key, column in REGION_FILTERS.items():
+        values = _values(params, key)
+        if values:
+            query['regions'][column] = values
+    b_types = _values(params, 'b_type')
+    if b_types:
+        query['b_type'] = b_types
+    for metric in METRICS:
+        low, high = _number(params, f'min_{metric}'), _number(params, f'max_{metric}')
+        if low is not None or high is not None:
+            query['ranges'][metric] = (low, high)
+
+    limit = _number(params, 'limit')
+    if limit is not None and not 1 <= limit <= MAX_LIMIT:
+        raise QueryError(f'limit must be between 1 and {MAX_LIMIT}')
+    query['limit'] = DEFAULT_LIMIT if limit is None else int(limit)
+    query['format'] = _single(params, 'format') or 'ndjson'
+    if query['format'] not in FORMATS:
+        raise QueryError(f'format must be one of {", ".join(FORMATS)}')
+    query['cursor'] = _single(params, 'cursor') or None
+    return query
+
+
+def encode_cursor(version, row):
+    return base64.urlsafe_b64encode(json.dumps([version, int(row)]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, version):
+    """Last row returned before ``cursor``; QueryError if it is malformed, StaleCursor if it is outdated."""
+    try:
+        cursor_version, row = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        row = int(row)
+    except (ValueError, TypeError):
+        raise QueryError('invalid cursor') from None
+    if cursor_version != version:
+        raise StaleCursor('the data changed since this cursor was issued; restart the query')
+    return row
+
+
+class BuildingQueryEngine:
+    """Select and serialize buildings of a ``BuildingStore``."""
+
+    def __init__(self, store, cell_size=0.01):
+        self.store = store
+        self.index = PointGridIndex(store.lon, store.lat, cell_size)
+
+    @property
+    def version(self):
+        return self.store.version
+
+    def select(self, query):
+        """Rows of the store matching ``query`` (see ``parse_query``), ascending."""
+        import shapely
+
+        store = self.store
+        rows = None
+        name_1 = query['regions'].get('NAME_1')
+        name_2 = query['regions'].get('NAME_2')
+        if name_2:
+            # The buildings of a city are one slice of the store; a name can be
+            # a city in several provinces, so take the slice of each of them
+            partitions = sorted((store.partition(location) for location in store.locations()
+                                 if location[1] in name_2 and (not name_1 or location[0] in name_1)),
+                                key=lambda partition: partition.start)
+            rows = np.concatenate([np.arange(partition.start, partition.stop) for partition in partitions]
+                                  + [np.empty(0, dtype=np.int64)])
+        if 'bbox' in query:
+            rows = self._intersect(rows, self.index.query(query['bbox']))
+        if 'polygon' in query:
+            polygon = query['polygon']
+            candidates = self._intersect(rows, self.index.query(polygon.bounds))
+            rows = candidates[shapely.contains_xy(polygon, store.lon[candidates], store.lat[candidates])]
+        if rows is None:
+            rows = np.arange(len(store))
+
+        keep = np.ones(len(rows), dtype=bool)
+        filters = dict(query['regions'])
+        if 'b_type' in query:
+            filters['b_type'] = query['b_type']
+        for column, values in filters.items():
+            codes = np.flatnonzero(np.isin(store.labels[column].astype(str), values))
+            keep &= np.isin(store.codes[column][rows], codes)
+        for metric, (low, high) in query['ranges'].items():
+            values = store.metrics[metric][rows]
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+        return rows[keep]
+
+    @staticmethod
+    def _intersect(rows, candidates):
+        return candidates if rows is None else np.intersect1d(rows, candidates, assume_unique=True)
+
+    def page(self, query):
+        """Rows of one page of ``query``, the cursor of the next page (or None) and the match count."""
+        rows = self.select(query)
+        total = len(rows)
+        if query['cursor'] is not None:
+            after = decode_cursor(query['cursor'], self.version)
+            rows = rows[np.searchsorted(rows, after, side='right'):]
+        next_cursor = None
+        if len(rows) > query['limit']:
+            rows = rows[:query['limit']]
+            next_cursor = encode_cursor(self.version, rows[-1])
+        return rows, next_cursor, total
+
+    def frame(self, rows):
+        """DataFrame of ``rows``: id, centroid, metrics and labels."""
+        store = self.store
+        data = {'building_id': store.building_id[rows], 'lon': store.lon[rows], 'lat': store.lat[rows]}
+        for metric in METRICS:
+            data[metric] = store.metrics[metric][rows]
+        for column in CATEGORIES:
+            data[column] = store.label(column, rows)
+        return pd.DataFrame(data)
+
+    def ndjson_chunks(self, rows, batch_size=BATCH_SIZE):
+        for start in range(0, len(rows), batch_size):
+            frame = self.frame(rows[start:start + batch_size])
+            for metric in METRICS:
+                frame[metric] = _shortest_float64(frame[metric].to_numpy())
+            text = frame.to_json(orient='records', lines=True)
+            yield text if text.endswith('\n') else text + '\n'
+
+    def arrow_schema(self):
+        import pyarrow as pa
+
+        fields = [('building_id', pa.from_numpy_dtype(self.store.building_id.dtype)),
+                  ('lon', pa.float64()), ('lat', pa.float64())]
+        fields += [(metric, pa.from_numpy_dtype(self.store.metrics[metric].dtype)) for metric in METRICS]
+        fields += [(column, pa.string()) for column in CATEGORIES]
+        return pa.schema(fields)
+
+    def arrow_chunks(self, rows, batch_size=BATCH_SIZE):
+        import pyarrow as pa
+
+        schema = self.arrow_schema()
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for start in range(0, len(rows), batch_size):
+                batch = pa.RecordBatch.from_pandas(self.frame(rows[start:start + batch_size]),
+                                                   schema=schema, preserve_index=False)
+                writer.write_batch(batch)
+                yield _drain(sink)
+        yield _drain(sink)
+
+
+def _shortest_float64(values):
+    """float32 ``values`` as the float64 of their shortest decimal form.
+
+    JSON encodes floats as doubles, which would show float32 values with
+    their binary noise (200.6900024414 for 200.69).
+    """
+    if values.dtype != np.float32:
+        return values
+    return values.astype(str).astype('float64')
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def register_building_api(server, engine, route=API_ROUTE):
+    """Serve the bulk query API from ``server``.
+
+    ``engine`` is a ``BuildingQueryEngine`` or a function returning the
+    current one.  The page is selected before the response starts and
+    written from that engine, so a reload halfway through a stream does
+    not mix two versions of the data.
+    """
+    from flask import Response, jsonify, request
+
+    current_engine = engine if callable(engine) else lambda: engine
+
+    @server.route(route, methods=['GET', 'POST'])
+    def query_buildings():
+        try:
+            body = request.get_json(silent=False) if request.method == 'POST' else None
+        except Exception:
+            return jsonify(error='the request body must be JSON'), 400
+        query_engine = current_engine()
+        try:
+            query = parse_query(request.args, body)
+            rows, next_cursor, total = query_engine.page(query)
+        except QueryError as error:
+            return jsonify(error=str(error)), 400
+        except StaleCursor as error:
+            return jsonify(error=str(error)), 410
+
+        chunks = query_engine.arrow_chunks(rows) if query['format'] == 'arrow' else query_engine.ndjson_chunks(rows)
+        response = Response(chunks, mimetype=FORMATS[query['format']])
+        response.headers['X-Total-Count'] = str(total)
+        response.headers['Cache-Control'] = 'no-store'
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = next_cursor
+            if request.method == 'GET':
+                args = request.args.to_dict(flat=False)
+                args['cursor'] = [next_cursor]
+                response.headers['Link'] = f'<{request.base_url}?{urlencode(args, doseq=True)}>; rel="next"'
+        return response
+
+    return query_buildings
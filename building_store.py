@@ -0,0 +1,117 @@
+"""Compact columnar store of the buildings shown by the dashboard.
+
+Instead of keeping ``converted_gdf``, ``merged_data`` and their renamed
+copies around with full shapely polygons, float64 metrics and object
+strings, every callback reads from one set of contiguous NumPy arrays:
+
+* ``lon``/``lat``: building centroids (float64, so clicks map back exactly),
+* ``capacity``/``suitarea``/``potential``: float32 metrics,
+* ``b_type``/``city``/``NAME_1``/``NAME_2``/``NAME_3``: integer codes into small label
+  arrays (``-1`` where a building is outside every region).
+
+Rows are sorted by NAME_1 and NAME_2 so the buildings of a city are one
+slice; a city is a ``(NAME_1, NAME_2)`` pair, as several provinces have a
+city of the same name.  The footprint polygons are not kept here; the
+vector tiles read them from the GeoParquet cache (see vector_tiles.py).
+"""
+import numpy as np
+import pandas as pd
+
+METRICS = ['capacity', 'suitarea', 'potential']
+CATEGORIES = ['b_type', 'city', 'NAME_1', 'NAME_2', 'NAME_3']
+
+
+def building_table(converted_gdf, merged_data):
+    """Lay out the buildings for the store: one row per building, sorted by NAME_1 and NAME_2.
+
+    ``merged_data`` carries the region assignment of ``converted_gdf``'s rows
+    (same index); a building matched to several regions keeps the first one.
+    """
+    assignment = merged_data[~merged_data.index.duplicated()][['NAME_1', 'NAME_2', 'NAME_3']]
+    assignment = assignment.reindex(converted_gdf.index)
+    table = pd.DataFrame({
+        'building_id': converted_gdf.index.to_numpy(),
+        'lon': converted_gdf['centroid_lon'].to_numpy('float64'),
+        'lat': converted_gdf['centroid_lat'].to_numpy('float64'),
+    })
+    for metric in METRICS:
+        table[metric] = converted_gdf[metric].to_numpy('float32')
+    for column in ['b_type', 'city']:
+        table[column] = pd.Categorical(converted_gdf[column].to_numpy())
+    for column in ['NAME_1', 'NAME_2', 'NAME_3']:
+        table[column] = pd.Categorical(assignment[column].to_numpy())
+    return table.sort_values(['NAME_1', 'NAME_2'], kind='stable', na_position='last').reset_index(drop=True)
+
+
+class BuildingStore:
+    """Read-only column arrays of every building, grouped by city (NAME_1, NAME_2).
+
+    ``version`` identifies the data the store was built from (e.g. the cache
+    fingerprint), for clients that refer to rows across requests.
+    """
+
+    def __init__(self, table, version=None):
+        self.version = version
+        self.building_id = table['building_id'].to_numpy()
+        self.lon = table['lon'].to_numpy()
+        self.lat = table['lat'].to_numpy()
+        self.metrics = {metric: table[metric].to_numpy() for metric in METRICS}
+        self.codes = {}
+        self.labels = {}
+        for column in CATEGORIES:
+            categorical = table[column].astype('category')
+            self.codes[column] = categorical.cat.codes.to_numpy()
+            self.labels[column] = categorical.cat.categories.to_numpy()
+
+        self._partitions = {}
+        name_1_codes = self.codes['NAME_1']
+        name_2_codes = self.codes['NAME_2']
+        boundaries = np.flatnonzero((np.diff(name_1_codes) != 0) | (np.diff(name_2_codes) != 0)) + 1
+        starts = np.concatenate([[0], boundaries])
+        stops = np.concatenate([boundaries, [len(name_2_codes)]])
+        for start, stop in zip(starts, stops):
+            if stop > start and name_1_codes[start] >= 0 and name_2_codes[start] >= 0:
+                location = (self.labels['NAME_1'][name_1_codes[start]], self.labels['NAME_2'][name_2_codes[start]])
+                self._partitions[location] = slice(int(start), int(stop))
+
+    def __len__(self):
+        return len(self.lon)
+
+    def locations(self):
+        """``(NAME_1, NAME_2)`` of every city, by number of buildings, largest first."""
+        sizes = {name: rows.stop - rows.start for name, rows in self._partitions.items()}
+        return sorted(sizes, key=sizes.get, reverse=True)
+
+    def partition(self, location):
+        """Row slice of the buildings in the ``(NAME_1, NAME_2)`` city (empty if unknown)."""
+        return self._partitions.get(location, slice(0, 0))
+
+    def label(self, column, rows):
+        codes = self.codes[column][rows]
+        labels = self.labels[column]
+        if len(labels) == 0:
+            return np.full(len(codes), None, dtype=object)
+        return np.where(codes >= 0, labels[np.clip(codes, 0, None)], None)
+
+    def frame(self, rows, metric_labels=None, columns=('NAME_3',)):
+        """Small DataFrame of ``rows`` for a figure: centroids, labels and metrics.
+
+        ``metric_labels`` maps the metric names to the column names the
+        figures use, e.g. ``{'capacity': 'Estimated Capacity (kWp)'}``.
+        """
+        metric_labels = metric_labels or {metric: metric for metric in METRICS}
+        data = {'centroid_lon': self.lon[rows], 'centroid_lat': self.lat[rows]}
+        for column in columns:
+            data[column] = self.label(column, rows)
+        for metric, label in metric_labels.items():
+            data[label] = self.metrics[metric][rows]
+        return pd.DataFrame(data)
+
+    def row(self, row):
+        """Attributes of one building as a dict of plain Python values."""
+        values = {'building_id': self.building_id[row].item(), 'lon': float(self.lon[row]), 'lat': float(self.lat[row])}
+        for metric in METRICS:
+            values[metric] = float(self.metrics[metric][row])
+        for column in CATEGORIES:
+            values[column] = self.label(column, slice(row, row + 1))[0]
+        return values
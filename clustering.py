@@ -0,0 +1,160 @@
+"""Server-side viewport clustering for the Building Map Locator.
+
+Shipping every building centroid to the browser and clustering there makes
+the payload and browser memory grow with the dataset.  Instead, points are
+aggregated once at load into a grid of ``cell_pixels`` wide cells for every
+zoom level (the same idea as supercluster's grid), and the map only receives
+the clusters and single buildings that fall inside its current viewport.
+"""
+import math
+
+import numpy as np
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+
+
+def _world_x(lon):
+    return (np.asarray(lon, dtype='float64') + 180.0) / 360.0 * TILE_SIZE
+
+
+def _world_y(lat):
+    lat = np.radians(np.clip(np.asarray(lat, dtype='float64'), -MAX_LATITUDE, MAX_LATITUDE))
+    return (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * TILE_SIZE
+
+
+def viewport_from_relayout(relayout_data, default_center, default_zoom, width=1000, height=1500):
+    """Return ``(zoom, (west, south, east, north))`` from a mapbox relayoutData.
+
+    Plotly reports the visible corners as ``mapbox._derived``; when they are
+    missing (first render, programmatic updates) the bounds are estimated
+    from the center, zoom and figure size.
+    """
+    relayout_data = relayout_data or {}
+    zoom = relayout_data.get('mapbox.zoom', default_zoom)
+    derived = relayout_data.get('mapbox._derived', {}).get('coordinates')
+    if derived:
+        lons = [corner[0] for corner in derived]
+        lats = [corner[1] for corner in derived]
+        return zoom, (min(lons), min(lats), max(lons), max(lats))
+
+    center = relayout_data.get('mapbox.center', default_center)
+    scale = TILE_SIZE * 2 ** zoom
+    half_width = width / 2 / scale * 360.0
+    center_y = _world_y(center['lat']) / TILE_SIZE * scale
+    north = _lat_from_pixel(center_y - height / 2, scale)
+    south = _lat_from_pixel(center_y + height / 2, scale)
+    return zoom, (center['lon'] - half_width, south, center['lon'] + half_width, north)
+
+
+def _lat_from_pixel(y, scale):
+    n = math.pi - 2.0 * math.pi * y / scale
+    return math.degrees(math.atan(math.sinh(n)))
+
+
+class GridClusterIndex:
+    """Per-zoom grid aggregation of points with viewport queries.
+
+    ``categories`` is an optional array of labels (e.g. building type), or of
+    integer codes into ``category_labels`` (``-1`` for missing); the most
+    common label of each cluster is reported alongside its count.
+    """
+
+    def __init__(self, lon, lat, categories=None, min_zoom=0, max_zoom=16, cell_pixels=60, category_labels=None):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cell_pixels = cell_pixels
+        self.lon = np.asarray(lon, dtype='float64')
+        self.lat = np.asarray(lat, dtype='float64')
+        if categories is None:
+            categories = np.zeros(len(self.lon), dtype='int64')
+        if category_labels is None:
+            self.category_codes, self.category_labels = _factorize(categories)
+        else:
+            self.category_codes, self.category_labels = _with_missing(categories, category_labels)
+
+        x = _world_x(self.lon)
+        y = _world_y(self.lat)
+        order = np.arange(len(self.lon))
+        self._levels = {}
+        for zoom in range(min_zoom, max_zoom + 1):
+            self._levels[zoom] = self._aggregate(x, y, order, zoom)
+
+    def _aggregate(self, x, y, order, zoom):
+        cell_size = self.cell_pixels / 2 ** zoom
+        cell_x = np.floor(x / cell_size).astype('int64')
+        cell_y = np.floor(y / cell_size).astype('int64')
+        cells, inverse = np.unique(np.stack([cell_x, cell_y]), axis=1, return_inverse=True)
+        inverse = inverse.ravel()
+        n_clusters = cells.shape[1]
+
+        count = np.bincount(inverse, minlength=n_clusters)
+        lon = np.bincount(inverse, weights=self.lon, minlength=n_clusters) / count
+        lat = np.bincount(inverse, weights=self.lat, minlength=n_clusters) / count
+
+        n_categories = max(len(self.category_labels), 1)
+        per_category = np.bincount(inverse * n_categories + self.category_codes,
+                                   minlength=n_clusters * n_categories).reshape(n_clusters, n_categories)
+        dominant = per_category.argmax(axis=1)
+
+        # Remember the member of every single-point cluster so it can be
+        # drawn (and clicked) as the building itself.
+        first_member = np.empty(n_clusters, dtype='int64')
+        first_member[inverse[::-1]] = order[::-1]
+        point_id = np.where(count == 1, first_member, -1)
+
+        # np.unique sorts by cell_x then cell_y, so a viewport becomes one
+        # binary search over cell_x plus a mask on the (few) candidates.
+        return {
+            'cell_x': cells[0],
+            'cell_y': cells[1],
+            'lon': lon,
+            'lat': lat,
+            'count': count,
+            'category': dominant,
+            'point_id': point_id,
+        }
+
+    def query(self, zoom, bounds):
+        """Return the clusters and points inside ``bounds`` at ``zoom``.
+
+        ``bounds`` is ``(west, south, east, north)`` in degrees.  Above
+        ``max_zoom`` every building in the viewport is returned on its own.
+        """
+        west, south, east, north = bounds
+        if zoom > self.max_zoom:
+            mask = (self.lon >= west) & (self.lon <= east) & (self.lat >= south) & (self.lat <= north)
+            ids = np.flatnonzero(mask)
+            return {
+                'lon': self.lon[ids],
+                'lat': self.lat[ids],
+                'count': np.ones(len(ids), dtype='int64'),
+                'category': self.category_codes[ids],
+                'point_id': ids,
+            }
+
+        level_zoom = int(min(max(math.floor(zoom), self.min_zoom), self.max_zoom))
+        level = self._levels[level_zoom]
+        cell_size = self.cell_pixels / 2 ** level_zoom
+        x_min, x_max = np.floor(_world_x([west, east]) / cell_size).astype('int64')
+        y_min, y_max = np.floor(_world_y([north, south]) / cell_size).astype('int64')
+
+        start, stop = np.searchsorted(level['cell_x'], [x_min, x_max + 1])
+        rows = np.arange(start, stop)
+        rows = rows[(level['cell_y'][rows] >= y_min) & (level['cell_y'][rows] <= y_max)]
+        return {name: level[name][rows] for name in ('lon', 'lat', 'count', 'category', 'point_id')}
+
+
+def _factorize(values):
+    values = np.asarray(values)
+    labels, codes = np.unique(values.astype(str), return_inverse=True)
+    return codes.ravel().astype('int64'), labels
+
+
+def _with_missing(codes, labels, missing_label='n.a.'):
+    codes = np.asarray(codes, dtype='int64')
+    labels = np.asarray(labels).astype(str)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels = np.append(labels, missing_label)
+    return codes, labels
@@ -0,0 +1,138 @@
+"""Reload the datasets in the background while the server keeps running.
+
+``DatasetWatcher`` polls groups of files in a daemon thread and calls the
+handler of a group once its files have changed and then stayed the same
+for one more poll, so a file that is still being copied is not read half
+written.  Handlers rebuild what depends on their files off the request
+path and swap it in at the end.
+
+``SwapLock`` makes that swap atomic for the callbacks: any number of
+callbacks hold it for reading at once, and a swap waits for the running
+ones to finish and holds back new ones only while the references are
+replaced.
+"""
+import contextlib
+import functools
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(paths):
+    """Size and modification time of every path (None for missing files).
+
+    A folder stands for the files in it, so adding, changing or removing
+    any of them changes the signature.
+    """
+    signature = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            signature.extend(file_signature(sorted(child for child in path.iterdir() if child.is_file())))
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            signature.append((str(path), None))
+        else:
+            signature.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class DatasetWatcher:
+    """Poll groups of files and call a handler when a group changes."""
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._groups = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, paths, handler):
+        """Call ``handler()`` whenever one of ``paths`` changes."""
+        paths = [Path(path) for path in paths]
+        signature = file_signature(paths)
+        self._groups.append({'paths': paths, 'handler': handler, 'seen': signature, 'pending': None})
+
+    def poll(self):
+        """Check every group once; run the handlers of the groups that settled after a change."""
+        for group in self._groups:
+            signature = file_signature(group['paths'])
+            if signature == group['seen']:
+                group['pending'] = None
+                continue
+            if signature != group['pending']:
+                # Changed since the last poll: wait for one more to be sure the write is done.
+                group['pending'] = signature
+                continue
+            group['seen'] = signature
+            group['pending'] = None
+            try:
+                group['handler']()
+            except Exception:
+                # Keep serving the previous data; the next change triggers another attempt.
+                logger.exception('Reloading %s failed', ', '.join(path.name for path in group['paths']))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='dataset-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+class SwapLock:
+    """Readers-writer lock that lets a reload swap data in between callbacks."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._swapping = False
+
+    @contextlib.contextmanager
+    def reading(self):
+        with self._condition:
+            while self._swapping:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def swapping(self):
+        with self._condition:
+            # Claim the swap first so that new readers queue up behind it.
+            while self._swapping:
+                self._condition.wait()
+            self._swapping = True
+            while self._readers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._swapping = False
+                self._condition.notify_all()
+
+    def reader(self, function):
+        """Decorator running ``function`` while holding the lock for reading."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.reading():
+                return function(*args, **kwargs)
+        return wrapper
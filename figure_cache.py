@@ -0,0 +1,79 @@
+"""Bounded LRU cache for the Plotly figures built by the dashboard callbacks.
+
+The Choropleth Map Locator only has ``metrics x locations`` distinct views,
+so a figure built once for a (callback, metric, location) key can be served
+again to every later user.  Entries are evicted least-recently-used once the
+serialized size of the cached figures goes over ``max_bytes``.
+"""
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+
+def figure_size(figure):
+    """Approximate the memory held by a figure by its JSON size in bytes."""
+    return len(pio.to_json(figure, validate=False))
+
+
+class FigureCache:
+    """Thread-safe LRU of figures bounded by their total serialized size."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        """Return the cached figure for ``key`` or None, counting a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, figure):
+        size = figure_size(figure)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (figure, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,388 @@
+"""Precompiled geodata artifacts for the Solar Energy Dashboard.
+
+Reading the building GeoJSON and the GADM level-3 shapefile, reprojecting,
+joining and aggregating them is by far the slowest part of starting app.py.
+This module runs that pipeline once and writes the derived frames as
+GeoParquet into ``datasets/cache``.  The cache is keyed by a fingerprint of
+the source files, so it only rebuilds itself when one of the inputs changes.
+
+Build (or refresh) the cache from the command line with:
+
+    python geodata_cache.py            # rebuild only if an input changed
+    python geodata_cache.py --force    # always rebuild
+
+Buildings added later can be dropped as GeoJSON files into
+``datasets/solar_data_batches``: a new batch is assigned to the regions on
+its own and appended to the cached artifacts (see ``append_buildings``),
+while a changed or removed batch rebuilds the cache like any other input.
+
+The geospatial libraries (geopandas, pyogrio, shapely, pyarrow) are imported
+by the functions that need them, so app.py can read the constants below
+without paying for those imports at startup.
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+DATASET_FOLDER = Path('datasets')
+CACHE_FOLDER_NAME = 'cache'
+MANIFEST_NAME = 'manifest.json'
+BUILD_LOCK_NAME = 'build.lock'
+# A lock older than this is taken to be left behind by a crashed build.
+BUILD_LOCK_TIMEOUT = 3600
+
+# Bump when the pipeline below changes so that stale artifacts are rebuilt.
+PIPELINE_VERSION = 9
+
+SOLAR_FILE = 'solar_data.geojson'
+GADM_FILE = 'gadm41_PHL_shp/gadm41_PHL_3.shp'
+# The shapefile is spread over several sidecar files; any of them changing
+# means the GADM data changed.
+SOURCE_FILES = [
+    SOLAR_FILE,
+    GADM_FILE,
+    'gadm41_PHL_shp/gadm41_PHL_3.dbf',
+    'gadm41_PHL_shp/gadm41_PHL_3.shx',
+    'gadm41_PHL_shp/gadm41_PHL_3.prj',
+]
+# GeoJSON files of buildings appended after SOLAR_FILE, applied in name order
+BATCH_FOLDER = 'solar_data_batches'
+
+# GADM rows the dashboard covers; buildings outside their bounding box are
+# skipped while the GeoJSON is streamed in.  Set SOLAR_REGION_QUERY to cover
+# another area, or to an empty string for the whole country.
+REGION_QUERY = os.environ.get('SOLAR_REGION_QUERY', "NAME_1 == 'Metropolitan Manila'")
+
+# Metric CRS for the Philippines (UTM zone 51N), used for centroids.
+PROJECTED_CRS = "EPSG:32651"
+
+METRIC_COLUMNS = {
+    'capacity': 'Estimated Capacity (kWp)',
+    'suitarea': 'Estimated Suitable Area (sq.m)',
+    'potential': 'Estimated Yearly Potential Power (kWh)',
+}
+
+ARTIFACTS = [
+    'converted_gdf',
+    'gadm_data',
+    'merged_data',
+    'max_group_per_name3',
+    'gadm_data_with_group',
+    'gadm_data_with_dropdup_group',
+]
+
+# Artifacts without geometry, stored as plain Parquet tables.
+TABLE_ARTIFACTS = {'max_group_per_name3'}
+
+# Compact building store (centroids, float32 metrics, categorical codes)
+# read by the app, written as an Arrow IPC file that workers can memory-map.
+BUILDING_STORE = 'buildings.arrow'
+
+
+def source_fingerprint(dataset_folder=DATASET_FOLDER):
+    """Hash the name, size and modification time of every source file (and the region covered)."""
+    dataset_folder = Path(dataset_folder)
+    digest = hashlib.sha256(f'pipeline-{PIPELINE_VERSION}:{REGION_QUERY}'.encode())
+    for name in SOURCE_FILES:
+        path = dataset_folder / name
+        if path.exists():
+            stat = path.stat()
+            digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        else:
+            digest.update(f'{name}:missing'.encode())
+    return digest.hexdigest()
+
+
+def batch_signatures(dataset_folder=DATASET_FOLDER):
+    """``[name, size, mtime_ns]`` of every building batch, in the order they are appended."""
+    batch_folder = Path(dataset_folder) / BATCH_FOLDER
+    if not batch_folder.is_dir():
+        return []
+    signatures = []
+    for path in sorted(batch_folder.glob('*.geojson')):
+        stat = path.stat()
+        signatures.append([path.name, stat.st_size, stat.st_mtime_ns])
+    return signatures
+
+
+def read_batch(dataset_folder, name, gadm_data):
+    """Buildings of one batch file within the area covered."""
+    from ingest import area_of_interest, read_buildings
+
+    bbox, bbox_crs = area_of_interest(gadm_data, REGION_QUERY)
+    return read_buildings(Path(dataset_folder) / BATCH_FOLDER / name, bbox=bbox, bbox_crs=bbox_crs)
+
+
+def prepare_buildings(solar_data):
+    """Reproject the buildings to WGS84 and add their centroid columns."""
+    converted_gdf = solar_data.to_crs("EPSG:4326")
+    # Building centroids are computed once, in a projected CRS, and kept as
+    # plain float columns so the maps never touch the polygons per request.
+    centroids = solar_data.geometry.to_crs(PROJECTED_CRS).centroid.to_crs("EPSG:4326")
+    converted_gdf['centroid_lon'] = centroids.x.to_numpy()
+    converted_gdf['centroid_lat'] = centroids.y.to_numpy()
+    return converted_gdf
+
+
+def region_assigner(gadm_data):
+    from ingest import select_region
+    from region_assigner import RegionAssigner
+
+    metro_manila_data = select_region(gadm_data, REGION_QUERY)
+    metro_manila_data = metro_manila_data[["NAME_1", "NAME_2", "NAME_3", "geometry"]]
+    return RegionAssigner(metro_manila_data, columns=('NAME_1', 'NAME_2', 'NAME_3'))
+
+
+def group_regions(gadm_data, merged_data, max_group_per_name3):
+    """Attach the per-NAME_3 maxima to the GADM rows that contain buildings."""
+    valid_indices = merged_data['index_right'].unique()
+    filtered_gadm_data = gadm_data[gadm_data.index.isin(valid_indices)]
+    gadm_data_with_group = filtered_gadm_data.merge(max_group_per_name3, on='NAME_3', how='left')
+    gadm_data_with_group = gadm_data_with_group[gadm_data_with_group['NAME_3'] != 'n.a.']
+    # One row per barangay; names like 'Poblacion' recur in many cities
+    gadm_data_with_dropdup_group = gadm_data_with_group.drop_duplicates(subset=['NAME_1', 'NAME_2', 'NAME_3'])
+    return gadm_data_with_group, gadm_data_with_dropdup_group
+
+
+def build_artifacts(dataset_folder=DATASET_FOLDER, batches=None):
+    """Run the full spatial pipeline and return the derived frames by name.
+
+    The building ``batches`` (names, by default every file of the batch
+    folder) are appended after the buildings of SOLAR_FILE.
+    """
+    import geopandas as gpd
+    from ingest import area_of_interest, read_buildings
+
+    dataset_folder = Path(dataset_folder)
+    gadm_data = gpd.read_file(dataset_folder / GADM_FILE)
+    bbox, bbox_crs = area_of_interest(gadm_data, REGION_QUERY)
+    solar_data = read_buildings(dataset_folder / SOLAR_FILE, bbox=bbox, bbox_crs=bbox_crs)
+
+    converted_gdf = prepare_buildings(solar_data)
+    assigner = region_assigner(gadm_data)
+    merged_data = assigner.assign(converted_gdf)
+    merged_data = merged_data.rename(columns=METRIC_COLUMNS)
+    max_group_per_name3 = merged_data.groupby('NAME_3')[list(METRIC_COLUMNS.values())].max().reset_index()
+    gadm_data_with_group, gadm_data_with_dropdup_group = group_regions(gadm_data, merged_data, max_group_per_name3)
+
+    artifacts = {
+        'converted_gdf': converted_gdf,
+        'gadm_data': gadm_data,
+        'merged_data': merged_data,
+        'max_group_per_name3': max_group_per_name3,
+        'gadm_data_with_group': gadm_data_with_group,
+        'gadm_data_with_dropdup_group': gadm_data_with_dropdup_group,
+    }
+    if batches is None:
+        batches = [name for name, _, _ in batch_signatures(dataset_folder)]
+    for name in batches:
+        artifacts = append_buildings(artifacts, read_batch(dataset_folder, name, gadm_data), assigner)
+    return artifacts
+
+
+def append_buildings(artifacts, new_buildings, assigner=None):
+    """Return the artifacts extended with a batch of new buildings.
+
+    Only the new rows are reprojected and assigned to NAME_2/NAME_3, and
+    ``max_group_per_name3`` is updated from them alone; pass the same
+    ``assigner`` across batches to reuse its spatial index.
+    """
+    from region_assigner import combine_region_max
+
+    if assigner is None:
+        assigner = region_assigner(artifacts['gadm_data'])
+    new_converted = prepare_buildings(new_buildings)
+    # Number the new buildings after the existing ones, as if they had been
+    # part of the original file.
+    new_converted.index = pd.RangeIndex(len(artifacts['converted_gdf']),
+                                        len(artifacts['converted_gdf']) + len(new_converted))
+    new_merged = assigner.assign(new_converted).rename(columns=METRIC_COLUMNS)
+
+    converted_gdf = pd.concat([artifacts['converted_gdf'], new_converted])
+    merged_data = pd.concat([artifacts['merged_data'], new_merged])
+    max_group_per_name3 = combine_region_max(artifacts['max_group_per_name3'], new_merged,
+                                             'NAME_3', list(METRIC_COLUMNS.values()))
+    gadm_data_with_group, gadm_data_with_dropdup_group = group_regions(artifacts['gadm_data'], merged_data,
+                                                                        max_group_per_name3)
+    return dict(artifacts,
+                converted_gdf=converted_gdf,
+                merged_data=merged_data,
+                max_group_per_name3=max_group_per_name3,
+                gadm_data_with_group=gadm_data_with_group,
+                gadm_data_with_dropdup_group=gadm_data_with_dropdup_group)
+
+
+def _cache_folder(dataset_folder):
+    return Path(dataset_folder) / CACHE_FOLDER_NAME
+
+
+def _read_manifest(cache_folder):
+    try:
+        return json.loads((cache_folder / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(dataset_folder=DATASET_FOLDER):
+    """Return True when the cached artifacts match the current source files."""
+    cache_folder = _cache_folder(dataset_folder)
+    manifest = _read_manifest(cache_folder)
+    if manifest is None or manifest.get('fingerprint') != source_fingerprint(dataset_folder):
+        return False
+    if manifest.get('batches', []) != batch_signatures(dataset_folder):
+        return False
+    return (all((cache_folder / f'{name}.parquet').exists() for name in ARTIFACTS)
+            and (cache_folder / BUILDING_STORE).exists())
+
+
+@contextlib.contextmanager
+def build_lock(dataset_folder=DATASET_FOLDER, poll_interval=1.0):
+    """Let a single process rebuild the cache while the others wait for it.
+
+    Several server workers reloading the same changed dataset would
+    otherwise all run the pipeline and overwrite each other's files.
+    """
+    cache_folder = _cache_folder(dataset_folder)
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    lock_path = cache_folder / BUILD_LOCK_NAME
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > BUILD_LOCK_TIMEOUT:
+                    lock_path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        lock_path.unlink(missing_ok=True)
+
+
+def pending_batches(dataset_folder=DATASET_FOLDER, batches=None):
+    """Names of the batches a fresh cache still lacks, or None if it must be rebuilt.
+
+    Appending is only possible when the other sources are unchanged and the
+    batches already in the cache are still the first ones, as they were.
+    ``batches`` are the current ``batch_signatures`` if already taken.
+    """
+    manifest = _read_manifest(_cache_folder(dataset_folder))
+    if manifest is None or manifest.get('fingerprint') != source_fingerprint(dataset_folder):
+        return None
+    applied = manifest.get('batches', [])
+    current = batch_signatures(dataset_folder) if batches is None else batches
+    if current[:len(applied)] != applied:
+        return None
+    return [name for name, _, _ in current[len(applied):]]
+
+
+def write_artifacts(artifacts, fingerprint, dataset_folder=DATASET_FOLDER, batches=()):
+    """Write the frames as GeoParquet and record the fingerprint they came from.
+
+    ``fingerprint`` is the ``source_fingerprint`` and ``batches`` the
+    ``batch_signatures`` taken before the sources were read, so files
+    changed during the build leave the cache stale.
+    """
+    from building_store import building_table
+    from shared_store import write_arrow_store
+
+    cache_folder = _cache_folder(dataset_folder)
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    # Drop the manifest first so a crash halfway through never leaves a
+    # manifest pointing at a partial set of artifacts.
+    (cache_folder / MANIFEST_NAME).unlink(missing_ok=True)
+    for name in ARTIFACTS:
+        artifacts[name].to_parquet(cache_folder / f'{name}.parquet')
+    write_arrow_store(building_table(artifacts['converted_gdf'], artifacts['merged_data']),
+                      cache_folder / BUILDING_STORE)
+    # Identifies the data in the cache, appended batches included
+    version = hashlib.sha256(json.dumps([fingerprint, list(batches)]).encode()).hexdigest()
+    manifest = {'fingerprint': fingerprint, 'batches': list(batches), 'version': version, 'artifacts': ARTIFACTS}
+    tmp_path = cache_folder / (MANIFEST_NAME + '.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    tmp_path.replace(cache_folder / MANIFEST_NAME)
+
+
+def cache_fingerprint(dataset_folder=DATASET_FOLDER):
+    """Fingerprint of the data in the cache, sources and appended batches, or None without a cache."""
+    manifest = _read_manifest(_cache_folder(dataset_folder))
+    return manifest and manifest.get('version')
+
+
+def read_artifacts(dataset_folder=DATASET_FOLDER, names=None):
+    """Read the cached frames, all of them or only ``names``."""
+    import geopandas as gpd
+
+    cache_folder = _cache_folder(dataset_folder)
+    artifacts = {}
+    for name in ARTIFACTS if names is None else names:
+        if name in TABLE_ARTIFACTS:
+            artifacts[name] = pd.read_parquet(cache_folder / f'{name}.parquet')
+        else:
+            artifacts[name] = gpd.read_parquet(cache_folder / f'{name}.parquet')
+    return artifacts
+
+
+def load_artifacts(dataset_folder=DATASET_FOLDER, force=False, names=None):
+    """Return the derived frames, rebuilding the cache only when it is stale."""
+    if not force and is_fresh(dataset_folder):
+        return read_artifacts(dataset_folder, names)
+    with build_lock(dataset_folder):
+        # Another process may have rebuilt the cache while this one waited.
+        if not force and is_fresh(dataset_folder):
+            return read_artifacts(dataset_folder, names)
+        fingerprint, batches = source_fingerprint(dataset_folder), batch_signatures(dataset_folder)
+        pending = None if force else pending_batches(dataset_folder, batches)
+        if pending:
+            # Only new batches: assign just their buildings and extend the cached frames
+            artifacts = read_artifacts(dataset_folder)
+            assigner = region_assigner(artifacts['gadm_data'])
+            for name in pending:
+                artifacts = append_buildings(artifacts, read_batch(dataset_folder, name, artifacts['gadm_data']), assigner)
+        else:
+            artifacts = build_artifacts(dataset_folder, [name for name, _, _ in batches])
+        write_artifacts(artifacts, fingerprint, dataset_folder, batches)
+    return {name: artifacts[name] for name in (ARTIFACTS if names is None else names)}
+
+
+def load_building_store(dataset_folder=DATASET_FOLDER, memory_map=False):
+    """Open the compact building store of a fresh cache (see ``load_artifacts``).
+
+    With ``memory_map`` the arrays are views on the mapped Arrow file, shared
+    with every other process that maps it.
+    """
+    from building_store import BuildingStore
+    from shared_store import open_arrow_store
+
+    cache_folder = _cache_folder(dataset_folder)
+    table = open_arrow_store(cache_folder / BUILDING_STORE, memory_map=memory_map)
+    return BuildingStore(table, version=cache_fingerprint(dataset_folder)[:16])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the precompiled geodata cache used by app.py.')
+    parser.add_argument('--datasets', default=str(DATASET_FOLDER), help='dataset folder (default: %(default)s)')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the cache is fresh')
+    args = parser.parse_args()
+
+    if not args.force and is_fresh(args.datasets):
+        print(f'Geodata cache in {_cache_folder(args.datasets)} is up to date.')
+        return
+    with build_lock(args.datasets):
+        fingerprint, batches = source_fingerprint(args.datasets), batch_signatures(args.datasets)
+        write_artifacts(build_artifacts(args.datasets, [name for name, _, _ in batches]), fingerprint, args.datasets, batches)
+    print(f'Geodata cache written to {_cache_folder(args.datasets)}.')
+
+
+if __name__ == '__main__':
+    main()
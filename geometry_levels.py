@@ -0,0 +1,153 @@
+"""Multi-level simplified GADM geometries for the choropleth payloads.
+
+Passing full-resolution barangay polygons into ``px.choropleth_mapbox``
+makes Plotly serialize megabytes of GeoJSON on every callback.  The region
+polygons are simplified once at load at a few tolerances, serialized to
+GeoJSON per city (NAME_1, NAME_2) and per level, and served as static bytes; the figures
+only reference them by URL so the browser fetches (and caches) the level
+that fits the current zoom.  Geopandas and shapely are only imported when
+a store is built, so registering the route costs nothing at startup.
+"""
+import hashlib
+import math
+from urllib.parse import quote
+
+# Tolerances in degrees, level 0 being the original geometry.  At zoom 11 a
+# screen pixel is about 0.0007 degrees, so level 2 is already sub-pixel there.
+SIMPLIFY_TOLERANCES = [0.0, 0.00005, 0.0002, 0.0008]
+
+GEOJSON_ROUTE = '/geojson'
+
+# Deepest zoom a city view is opened at, however small the city
+MAX_VIEW_ZOOM = 15
+
+
+def _simplify(geometry, tolerance):
+    """Simplify a polygon coverage without opening gaps between neighbours."""
+    import geopandas as gpd
+    import shapely
+
+    if tolerance == 0:
+        return geometry
+    if hasattr(shapely, 'coverage_simplify'):
+        try:
+            if shapely.coverage_is_valid(geometry.values):
+                return gpd.GeoSeries(shapely.coverage_simplify(geometry.values, tolerance),
+                                     index=geometry.index, crs=geometry.crs)
+        except shapely.errors.GEOSException:
+            pass
+    # Older shapely/GEOS or polygons that do not form a clean coverage:
+    # simplify each polygon on its own, still keeping every ring valid.
+    return geometry.simplify(tolerance, preserve_topology=True)
+
+
+def level_for_zoom(zoom, tolerances=SIMPLIFY_TOLERANCES):
+    """Pick the coarsest level whose tolerance stays under half a screen pixel."""
+    half_pixel = 360.0 / (256 * 2 ** zoom) / 2
+    level = 0
+    for candidate, tolerance in enumerate(tolerances):
+        if tolerance <= half_pixel:
+            level = candidate
+    return level
+
+
+def view_for_bounds(bounds, width=600, height=700, max_zoom=MAX_VIEW_ZOOM):
+    """Return ``(center, zoom)`` of a ``width`` x ``height`` px map showing ``bounds`` whole.
+
+    ``bounds`` is ``(minlon, minlat, maxlon, maxlat)``; the zoom follows the
+    Web Mercator scale of the map tiles, 256 px per world at zoom 0.
+    """
+    minlon, minlat, maxlon, maxlat = bounds
+    mercator_y = lambda lat: math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+    zooms = [max_zoom]
+    if maxlon > minlon:
+        zooms.append(math.log2(width * 360 / (256 * (maxlon - minlon))))
+    if maxlat > minlat:
+        zooms.append(math.log2(height * 2 * math.pi / (256 * (mercator_y(maxlat) - mercator_y(minlat)))))
+    # Rounded down so the edges of the area stay in view
+    zoom = max(0.0, math.floor(min(zooms) * 10) / 10)
+    return {'lat': float(minlat + maxlat) / 2, 'lon': float(minlon + maxlon) / 2}, zoom
+
+
+class SimplifiedGeometryStore:
+    """Pre-serialized GeoJSON of ``regions`` per key value and simplification level.
+
+    ``key`` is a column, or a list of columns whose values form tuple keys.
+    """
+
+    def __init__(self, regions, key=('NAME_1', 'NAME_2'), tolerances=SIMPLIFY_TOLERANCES):
+        self.key = key if isinstance(key, str) else list(key)
+        self.tolerances = list(tolerances)
+        geometry = regions.geometry
+        if geometry.crs is not None:
+            geometry = geometry.to_crs("EPSG:4326")
+        self._payloads = {}
+        groups = regions.groupby(self.key, sort=False).indices
+        extents = geometry.bounds.to_numpy()
+        self._bounds = {key_value: (*extents[positions, :2].min(axis=0).tolist(), *extents[positions, 2:].max(axis=0).tolist())
+                        for key_value, positions in groups.items()}
+        for level, tolerance in enumerate(self.tolerances):
+            simplified = _simplify(geometry, tolerance)
+            for key_value, positions in groups.items():
+                body = simplified.iloc[positions].to_json(separators=(',', ':')).encode()
+                etag = hashlib.sha1(body).hexdigest()
+                self._payloads[(level, key_value)] = (body, etag)
+
+    def level_for_zoom(self, zoom):
+        return level_for_zoom(zoom, self.tolerances)
+
+    def bounds(self, key_value):
+        """``(minlon, minlat, maxlon, maxlat)`` of a key's regions, or None if unknown."""
+        return self._bounds.get(key_value)
+
+    def url(self, key_value, level):
+        # The ETag in the query string gives reloaded geometry a new URL, so
+        # browsers do not keep showing their cached copy of the old one.
+        parts = [key_value] if isinstance(self.key, str) else key_value or []
+        url = f"{GEOJSON_ROUTE}/{level}/{'/'.join(quote(str(part), safe='') for part in parts)}.json"
+        payload = self.payload(key_value, level)
+        return f"{url}?v={payload[1][:12]}" if payload else url
+
+    def key_from_path(self, path):
+        """Key value of the path ``url`` gave it (as decoded by the router)."""
+        if isinstance(self.key, str):
+            return path
+        # Only the last part can hold a decoded slash
+        return tuple(path.split('/', len(self.key) - 1))
+
+    def payload(self, key_value, level):
+        """Return ``(bytes, etag)`` for a key and level, or None if unknown."""
+        return self._payloads.get((level, key_value))
+
+    def size(self, key_value, level):
+        payload = self.payload(key_value, level)
+        return len(payload[0]) if payload else 0
+
+
+def register_geojson_route(server, store, max_age=86400):
+    """Serve the pre-serialized GeoJSON from ``server`` with HTTP caching.
+
+    ``store`` is a ``SimplifiedGeometryStore`` or a function returning the
+    current one, for stores that are replaced when the data is reloaded.
+    """
+    from flask import Response, abort, request
+
+    current_store = store if callable(store) else lambda: store
+
+    @server.route(f'{GEOJSON_ROUTE}/<int:level>/<path:key_value>.json')
+    def simplified_geojson(level, key_value):
+        store = current_store()
+        payload = store.payload(store.key_from_path(key_value), level)
+        if payload is None:
+            abort(404)
+        body, etag = payload
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/geo+json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        return response
+
+    return simplified_geojson
+
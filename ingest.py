@@ -0,0 +1,63 @@
+"""Column- and bbox-pruned streaming ingestion of the building GeoJSON.
+
+``gpd.read_file`` on ``solar_data.geojson`` materializes every property of
+every building before the spatial join throws most of them away.  Here the
+file is streamed in Arrow record batches through pyogrio, GDAL only decodes
+the columns the dashboard uses, and features outside the bounding box of
+the area of interest are skipped before they reach Python.  The kept
+chunks are concatenated at the end, so peak memory is about twice the kept
+buildings, however large the file is.
+"""
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyogrio
+from pyproj import CRS, Transformer
+
+BUILDING_COLUMNS = ['capacity', 'suitarea', 'potential', 'b_type', 'city']
+
+
+def select_region(gadm_data, query):
+    """GADM rows selected by ``query``, or all of them for an empty query."""
+    return gadm_data.query(query) if query else gadm_data
+
+
+def area_of_interest(gadm_data, query):
+    """Return ``(bounds, crs)`` of the GADM rows selected by ``query``."""
+    region = select_region(gadm_data, query)
+    return tuple(region.total_bounds), region.crs
+
+
+def _source_bbox(bbox, bbox_crs, source_crs):
+    """Express ``bbox`` in the CRS of the file, as GDAL filters in that CRS."""
+    if bbox is None or bbox_crs is None or source_crs is None:
+        return bbox
+    if CRS.from_user_input(bbox_crs) == CRS.from_user_input(source_crs):
+        return bbox
+    transformer = Transformer.from_crs(bbox_crs, source_crs, always_xy=True)
+    return transformer.transform_bounds(*bbox)
+
+
+def iter_buildings(path, columns=BUILDING_COLUMNS, bbox=None, bbox_crs=None, batch_size=65536):
+    """Yield GeoDataFrame chunks of the buildings intersecting ``bbox``."""
+    source_crs = pyogrio.read_info(path)['crs']
+    source_bbox = _source_bbox(bbox, bbox_crs, source_crs)
+    with pyogrio.open_arrow(path, columns=columns, bbox=source_bbox,
+                            batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        geometry_name = meta['geometry_name'] or 'wkb_geometry'
+        for batch in reader:
+            table = pa.Table.from_batches([batch])
+            geometry = gpd.GeoSeries.from_wkb(table.column(geometry_name).to_numpy(zero_copy_only=False),
+                                              crs=meta['crs'])
+            frame = table.drop_columns([geometry_name]).to_pandas()
+            yield gpd.GeoDataFrame(frame, geometry=geometry.values, crs=meta['crs'])
+
+
+def read_buildings(path, columns=BUILDING_COLUMNS, bbox=None, bbox_crs=None, batch_size=65536):
+    """Read the buildings intersecting ``bbox``, keeping only ``columns``."""
+    chunks = list(iter_buildings(path, columns, bbox, bbox_crs, batch_size))
+    if not chunks:
+        # Still return the expected columns so the rest of the pipeline works
+        # on an area with no buildings.
+        return gpd.GeoDataFrame(columns=columns, geometry=[], crs=pyogrio.read_info(path)['crs'])
+    return gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True), crs=chunks[0].crs)
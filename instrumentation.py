@@ -0,0 +1,199 @@
+"""Per-callback latency and payload instrumentation with a /metrics endpoint.
+
+Set ``SOLAR_METRICS=1`` to turn it on.  Every Dash callback decorated with
+``instrument_callback`` then records, in in-process histograms:
+
+* ``dash_callback_duration_seconds``: wall time of the callback function,
+* ``dash_figure_build_seconds``: time spent building figures (``measure``),
+* ``dash_callback_serialize_seconds``: time from the callback returning to
+  the response leaving Dash, i.e. JSON serialization of the outputs,
+* ``dash_callback_response_bytes``: size of the response body,
+
+plus ``dash_startup_phase_seconds`` for the data pipeline at import.  They
+are served in the Prometheus text format on ``/metrics``.  When the variable
+is not set, the decorator returns the callback unchanged and ``measure`` is
+a no-op context, so the cost is a single function call per figure.
+"""
+import bisect
+import contextlib
+import functools
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('SOLAR_METRICS', '0') == '1'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Labelled histograms and gauges rendered as Prometheus text."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._gauges = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_collector(self, collector):
+        """Register a callable returning ``[(name, labels, value), ...]`` gauges read at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            gauges = dict(self._gauges)
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[(name, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        for name in sorted({key[0] for key in histograms}):
+            lines += self._header(name, 'histogram')
+            for (metric, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {total}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+        for name in sorted({key[0] for key in gauges}):
+            lines += self._header(name, 'gauge')
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name, kind):
+        header = [f'# HELP {name} {self._help[name]}'] if name in self._help else []
+        return header + [f'# TYPE {name} {kind}']
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+registry = MetricsRegistry()
+registry.describe('dash_callback_duration_seconds', 'Wall time of the Dash callback function.')
+registry.describe('dash_figure_build_seconds', 'Time spent building Plotly figures.')
+registry.describe('dash_callback_serialize_seconds', 'Time between the callback returning and the response being ready.')
+registry.describe('dash_callback_response_bytes', 'Size of the callback response body.')
+registry.describe('dash_startup_phase_seconds', 'Duration of the data pipeline phases at startup.')
+
+
+def instrument_callback(name):
+    """Decorator recording wall time for a Dash callback; identity when disabled."""
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                registry.observe('dash_callback_duration_seconds', end - start, callback=name)
+                _remember_callback(name, end)
+        return wrapper
+    return decorator
+
+
+def _remember_callback(name, finished_at):
+    from flask import g, has_request_context
+    if has_request_context():
+        g.instrumented_callback = name
+        g.instrumented_callback_end = finished_at
+
+
+def measure(metric, buckets=LATENCY_BUCKETS, **labels):
+    """Context manager timing a block into histogram ``metric``; no-op when disabled."""
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return _Timer(metric, buckets, labels)
+
+
+class _Timer:
+    def __init__(self, metric, buckets, labels):
+        self.metric = metric
+        self.buckets = buckets
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.metric, time.perf_counter() - self.start, self.buckets, **self.labels)
+        return False
+
+
+@contextlib.contextmanager
+def startup_phase(name):
+    """Record how long a startup step takes; kept even when disabled since it runs once."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.set_gauge('dash_startup_phase_seconds', time.perf_counter() - start, phase=name)
+
+
+def register_metrics_route(server, route='/metrics'):
+    """Hook the Flask request cycle and serve the registry on ``route`` when enabled."""
+    if not ENABLED:
+        return
+    from flask import Response, g
+
+    @server.after_request
+    def record_callback_response(response):
+        name = g.pop('instrumented_callback', None)
+        if name is not None:
+            registry.observe('dash_callback_serialize_seconds',
+                             time.perf_counter() - g.pop('instrumented_callback_end'), callback=name)
+            if not response.direct_passthrough:
+                registry.observe('dash_callback_response_bytes', len(response.get_data()), SIZE_BUCKETS,
+                                 callback=name)
+        return response
+
+    @server.route(route)
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
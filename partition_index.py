@@ -0,0 +1,49 @@
+"""Per-location partition index for the choropleth page callbacks.
+
+The callbacks on the Choropleth Map Locator page only ever look at the rows
+of one city/municipality at a time, keyed by (NAME_1, NAME_2) since a
+NAME_2 can repeat across provinces.  Instead of scanning the whole frame
+with a boolean mask on every dropdown change, the frame is sorted by the
+key columns once at load and each key is mapped to its row-offset slice,
+so a lookup costs O(rows in the city) rather than O(all rows).
+"""
+import pandas as pd
+
+
+class PartitionIndex:
+    """Row-offset index of a frame sorted by a key column, or by several.
+
+    With a list of columns, the keys are tuples of their values.
+    """
+
+    def __init__(self, frame, column=('NAME_1', 'NAME_2')):
+        self.column = column if isinstance(column, str) else list(column)
+        # A stable sort keeps the original row order inside every partition,
+        # so the figures come out exactly as they did with a boolean mask.
+        # Frames already sorted by the key are used as they are, without
+        # copying.  Only the GADM region frames are indexed here; the
+        # buildings come as NAME_2 slices of the BuildingStore.
+        if isinstance(self.column, str):
+            keys = frame[self.column]
+        else:
+            keys = pd.MultiIndex.from_frame(frame[self.column])
+        if keys.is_monotonic_increasing:
+            self.frame = frame
+        else:
+            self.frame = frame.sort_values(self.column, kind='stable')
+        self._slices = {}
+        for key, positions in self.frame.groupby(self.column, sort=False, observed=True).indices.items():
+            self._slices[key] = slice(positions[0], positions[-1] + 1)
+
+    def __contains__(self, key):
+        return key in self._slices
+
+    def __len__(self):
+        return len(self._slices)
+
+    def keys(self):
+        return self._slices.keys()
+
+    def get(self, key):
+        """Return the rows for ``key``, or an empty frame if it is unknown."""
+        return self.frame.iloc[self._slices.get(key, slice(0, 0))]
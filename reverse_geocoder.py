@@ -0,0 +1,90 @@
+"""Offline reverse geocoding against the GADM level-3 boundaries.
+
+The Building Map Locator used to call Nominatim for every click on the
+cluster map, which blocks a server worker on an external HTTP round-trip,
+is rate-limited and does not work on hosts without internet access.  The
+GADM barangay polygons are already loaded by the dashboard, so a click is
+resolved locally with a spatial index lookup instead.  A remote backend can
+still be plugged in (e.g. Nominatim for street-level addresses) but it is
+off by default.
+"""
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+from shapely.geometry import Point
+
+Location = namedtuple('Location', ['address', 'barangay', 'city', 'province'])
+
+
+class NominatimBackend:
+    """Remote street-level lookups through geopy's Nominatim client."""
+
+    def __init__(self, user_agent="dash-reverse-geocoder", timeout=2):
+        from geopy.geocoders import Nominatim
+        self._geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def __call__(self, lat, lon):
+        location = self._geolocator.reverse((lat, lon))
+        return location.address if location is not None else None
+
+
+REMOTE_BACKENDS = {
+    'nominatim': NominatimBackend,
+}
+
+
+def remote_backend_from_env(variable='REVERSE_GEOCODER_REMOTE'):
+    """Build the remote backend named by an environment variable, if any."""
+    name = os.environ.get(variable, '').strip().lower()
+    if not name:
+        return None
+    if name not in REMOTE_BACKENDS:
+        raise ValueError(f"Unknown {variable} '{name}', expected one of {sorted(REMOTE_BACKENDS)}")
+    return REMOTE_BACKENDS[name]()
+
+
+class ReverseGeocoder:
+    """Resolve a point to barangay/city/province using the GADM polygons."""
+
+    def __init__(self, gadm_data, remote=None, cache_size=4096, precision=6):
+        regions = gadm_data[['NAME_1', 'NAME_2', 'NAME_3', 'geometry']]
+        if regions.crs is not None:
+            regions = regions.to_crs("EPSG:4326")
+        self._regions = regions.reset_index(drop=True)
+        self._names = self._regions[['NAME_1', 'NAME_2', 'NAME_3']].to_numpy()
+        self._sindex = self._regions.sindex
+        self._remote = remote
+        self._precision = precision
+        # Clicks on the same building always report the same coordinates,
+        # so rounded (lat, lon) pairs make a good cache key.
+        self._lookup = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def reverse(self, lat, lon):
+        return self._lookup(round(lat, self._precision), round(lon, self._precision))
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+    def _resolve(self, lat, lon):
+        point = Point(lon, lat)
+        matches = self._sindex.query(point, predicate='intersects')
+        if len(matches) == 0:
+            # Points just off the coast or on a gap between polygons fall back
+            # to the closest barangay.
+            matches = self._sindex.nearest(point, return_all=False)[1]
+        if len(matches) == 0:
+            province, city, barangay = None, None, None
+        else:
+            province, city, barangay = self._names[matches[0]]
+
+        address = None
+        if self._remote is not None:
+            try:
+                address = self._remote(lat, lon)
+            except Exception:
+                address = None
+        if address is None:
+            parts = [name for name in (barangay, city, province) if name and name != 'n.a.']
+            address = ', '.join(parts + ['Philippines'])
+        return Location(address, barangay, city, province)
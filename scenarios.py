@@ -0,0 +1,144 @@
+"""What-if scenarios over the building metrics.
+
+The ``capacity``, ``suitarea`` and ``potential`` of solar_data are fixed
+estimates.  A scenario changes them with three parameters:
+
+* panel efficiency (%): capacity scales with it, relative to the efficiency
+  implied by the data (the median capacity per m2 of suitable area),
+* adoption rate (%) per building type: the expected share of those
+  buildings that install panels,
+* degradation (% per year) over a number of years, applied to the yearly
+  potential.
+
+Every factor is constant per building type, so a scenario is a factor per
+type and metric, and the aggregates of one type are the precomputed ones of
+the ``AggregationCube`` scaled by it.  Over all types, count, sum, mean, min
+and max follow from those as well; only the percentiles are recomputed,
+with one sort of the scaled metric, when they are first looked up.  The
+``ScenarioCube`` of each parameter set is memoized.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from aggregation_cube import AggregationCube, PERCENTILES, STATISTICS, group_statistics
+
+# Used when the data gives no capacity per m2 to derive the efficiency from
+DEFAULT_EFFICIENCY = 17.0
+
+Scenario = namedtuple('Scenario', ['efficiency', 'adoption', 'degradation', 'years'])
+
+
+class ScenarioCube(AggregationCube):
+    """``AggregationCube`` of a scenario, derived from the cube of the data."""
+
+    def __init__(self, base, store, factors):
+        self.levels = base.levels
+        self.metrics = base.metrics
+        self.categories = base.categories
+        self.row_categories = base.row_categories
+        self.row_regions = base.row_regions
+        self._regions = base._regions
+        self._values = base._values
+        self._store = store
+        self._factors = factors
+        self._percentiles = {}
+
+    def values(self, metric, rows=slice(None)):
+        """Scenario value of ``metric`` for the buildings in ``rows``."""
+        factors = self._factors[metric].astype(self._store.metrics[metric].dtype)
+        return self._store.metrics[metric][rows] * factors[self.row_categories[rows]]
+
+    def _all_percentiles(self, level, metric):
+        key = level, metric
+        if key not in self._percentiles:
+            regions = self.row_regions[level]
+            inside = regions >= 0
+            statistics = group_statistics(regions[inside], self.values(metric)[inside], len(self._regions[level]))
+            self._percentiles[key] = statistics[:, [STATISTICS.index(name) for name in PERCENTILES]]
+        return self._percentiles[key]
+
+    def _cells(self, level, metric, statistic, category):
+        base = self._values[level][:, :, self.metrics.index(metric)]
+        factors = self._factors[metric]
+        statistic_position = STATISTICS.index(statistic)
+        if category is not None:
+            position = self.categories.index(category)
+            scale = 1.0 if statistic == 'count' else factors[position]
+            return base[:, position, statistic_position] * scale
+        count = base[:, -1, STATISTICS.index('count')]
+        if statistic == 'count':
+            return count
+        scaled = base[:, :-1, statistic_position] * factors
+        if statistic == 'sum':
+            return scaled.sum(axis=1)
+        if statistic == 'mean':
+            total = (base[:, :-1, STATISTICS.index('sum')] * factors).sum(axis=1)
+            return np.divide(total, count, out=np.full(len(count), np.nan), where=count > 0)
+        if statistic == 'min':
+            return np.fmin.reduce(scaled, axis=1)
+        if statistic == 'max':
+            return np.fmax.reduce(scaled, axis=1)
+        return self._all_percentiles(level, metric)[:, list(PERCENTILES).index(statistic)]
+
+
+class ScenarioEngine:
+    """Build and memoize the ``ScenarioCube`` of parameter sets."""
+
+    def __init__(self, store, cube, max_scenarios=32):
+        self.store = store
+        self.cube = cube
+        self.categories = cube.categories
+        self.max_scenarios = max_scenarios
+        capacity = store.metrics['capacity'].astype('float64')
+        suitarea = store.metrics['suitarea'].astype('float64')
+        known = (suitarea > 0) & (capacity > 0)
+        # kWp per m2 at the 1 kW/m2 of standard test conditions
+        self.baseline_efficiency = (round(float(np.median(capacity[known] / suitarea[known])) * 100, 1)
+                                    if known.any() else DEFAULT_EFFICIENCY)
+        self.baseline = self.scenario()
+        self._cubes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def scenario(self, efficiency=None, adoption=None, degradation=0.0, years=0):
+        """Scenario of the parameters, in percent; building types missing from ``adoption`` adopt 100%."""
+        efficiency = self.baseline_efficiency if efficiency is None else efficiency
+        adoption = adoption or {}
+        if not years:
+            # Nothing has degraded yet, whatever the rate
+            degradation = 0.0
+        return Scenario(round(float(efficiency), 4),
+                        tuple(round(float(adoption.get(category, 100.0)), 4) for category in self.categories),
+                        round(float(degradation), 4), int(years))
+
+    def factors(self, scenario):
+        """Per metric, the factor of every building type under ``scenario``."""
+        installed = scenario.efficiency / self.baseline_efficiency * np.array(scenario.adoption) / 100
+        return {
+            'capacity': installed,
+            'suitarea': np.ones(len(self.categories)),
+            'potential': installed * (1 - scenario.degradation / 100) ** scenario.years,
+        }
+
+    def cube_for(self, scenario):
+        """Aggregates of ``scenario``: the data's own cube for the baseline, else a memoized ``ScenarioCube``."""
+        if scenario == self.baseline:
+            return self.cube
+        with self._lock:
+            cube = self._cubes.get(scenario)
+            if cube is not None:
+                self._cubes.move_to_end(scenario)
+                return cube
+        cube = ScenarioCube(self.cube, self.store, self.factors(scenario))
+        with self._lock:
+            self._cubes[scenario] = cube
+            while len(self._cubes) > self.max_scenarios:
+                self._cubes.popitem(last=False)
+        return cube
+
+    def values(self, scenario, metric, rows=slice(None)):
+        """Scenario value of ``metric`` for the buildings in ``rows``."""
+        if scenario == self.baseline:
+            return self.store.metrics[metric][rows]
+        return self.cube_for(scenario).values(metric, rows)
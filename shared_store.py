@@ -0,0 +1,34 @@
+"""Memory-mapped Arrow IPC store shared read-only by all server workers.
+
+Each worker process of a WSGI server imports app.py on its own and would
+otherwise hold a private copy of the building data.  The building store is
+written once as an uncompressed Arrow IPC file and every worker can
+memory-map it: numeric columns are handed to pandas as views on the
+mapping, so their pages live in the OS page cache once for all workers.
+"""
+from pathlib import Path
+
+import pyarrow as pa
+
+
+def write_arrow_store(frame, path):
+    """Write ``frame`` as an uncompressed Arrow IPC file, replacing ``path`` atomically."""
+    path = Path(path)
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with pa.OSFile(str(tmp_path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    tmp_path.replace(path)
+
+
+def open_arrow_store(path, memory_map=True):
+    """Open an Arrow IPC file as a read-only DataFrame.
+
+    With ``memory_map`` the file is mapped rather than read, and
+    ``split_blocks`` keeps every column in its own block, which lets pandas
+    wrap null-free numeric columns around the mapped buffers without copying.
+    """
+    source = pa.memory_map(str(path), 'r') if memory_map else pa.OSFile(str(path), 'rb')
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True, self_destruct=False)
@@ -0,0 +1,88 @@
+"""Pre-serialized figures served compressed with HTTP caching.
+
+The home page figures only change when their CSV does, yet they used to be
+part of the layout ``render_content`` returns, so every visit to the Home
+tab serialized them again and sent them uncompressed.  Here each figure is
+serialized once to JSON bytes and compressed with gzip (and brotli, when
+the ``brotli`` package is installed), and ``/figures/<name>.json`` serves
+the encoding the browser accepts.  The graphs fetch that URL client side.
+
+The URL carries the ETag of the figure, so browsers keep it for as long as
+the figure does not change; a rebuilt figure (see ``put``) gets a new URL,
+and a request without the current version revalidates, costing a 304.
+"""
+import gzip
+import hashlib
+from urllib.parse import quote
+
+FIGURE_ROUTE = '/figures'
+# Preferred first when the browser accepts several
+ENCODINGS = ['br', 'gzip', 'identity']
+
+
+def compress(body):
+    """Every encoding of ``body`` that can be produced here, by name."""
+    encodings = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        encodings['br'] = brotli.compress(body, quality=11)
+    return encodings
+
+
+class StaticFigureStore:
+    """JSON of named figures, serialized and compressed once per version."""
+
+    def __init__(self):
+        self._payloads = {}
+
+    def put(self, name, figure):
+        """Serialize ``figure`` as ``name``, replacing its previous version at once."""
+        import plotly.io as pio
+
+        body = pio.to_json(figure, validate=False).encode()
+        self._payloads[name] = (compress(body), hashlib.sha1(body).hexdigest())
+
+    def payload(self, name):
+        """Return ``(encodings, etag)`` of a figure, or None if unknown."""
+        return self._payloads.get(name)
+
+    def url(self, name):
+        return f"{FIGURE_ROUTE}/{quote(name, safe='')}.json?v={self._payloads[name][1][:12]}"
+
+    def sizes(self):
+        """Bytes of every figure per encoding, as ``{(name, encoding): size}``."""
+        return {(name, encoding): len(body) for name, (encodings, _) in self._payloads.items()
+                for encoding, body in encodings.items()}
+
+
+def register_figure_route(server, store, max_age=31536000):
+    """Serve the figures of ``store`` from ``server`` with compression and HTTP caching."""
+    from flask import Response, abort, request
+
+    @server.route(f'{FIGURE_ROUTE}/<name>.json')
+    def static_figure(name):
+        payload = store.payload(name)
+        if payload is None:
+            abort(404)
+        encodings, etag = payload
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            encoding = request.accept_encodings.best_match([e for e in ENCODINGS if e in encodings], 'identity')
+            response = Response(encodings[encoding], mimetype='application/json')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        # Weak: the same figure is sent in several encodings
+        response.set_etag(etag, weak=True)
+        response.headers['Vary'] = 'Accept-Encoding'
+        if request.args.get('v') == etag[:12]:
+            response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        else:
+            # Unversioned, or a version replaced since the page was rendered
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    return static_figure
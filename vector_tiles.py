@@ -0,0 +1,344 @@
+"""Mapbox vector tiles (MVT) of the GADM boundaries and building footprints.
+
+Embedding geometry in the figures makes every map payload grow with the
+dataset, which rules out going beyond Metro Manila.  Here the boundaries and
+footprints are cut into standard web-mercator tiles and the maps add them
+as vector layers: the browser only fetches the tiles of its viewport, so a
+payload depends on the viewport rather than on the number of buildings.
+
+Layers (see ``LAYERS``):
+
+* ``provinces``: GADM NAME_1 outlines, for the zoomed-out views,
+* ``barangays``: GADM level-3 polygons with NAME_1, NAME_2 and NAME_3,
+* ``buildings``: footprints with their type, city and metrics.
+
+Tiles are stored gzipped under ``datasets/cache/tiles/<version>``, where the
+version comes from the geodata cache fingerprint, so they are regenerated
+with the cache and their URLs can be cached forever.  Pre-generate them with
+
+    python vector_tiles.py --max-zoom 14
+
+The maps load the tiles through a TileJSON (``/tiles/<version>.json``) whose
+``maxzoom`` is ``MAX_ZOOM``, so past that zoom they overzoom the deepest
+tiles instead of requesting new ones.  Tiles that were not pre-generated
+are cut on their first request and stored there as well.  Tiles outside the bounds of the
+data and tiles without features are answered empty and never stored, so
+requests cannot fill the disk with them.
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import shutil
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from geodata_cache import CACHE_FOLDER_NAME, DATASET_FOLDER, cache_fingerprint, source_fingerprint
+
+TILE_ROUTE = '/tiles'
+TILE_FOLDER_NAME = 'tiles'
+WEB_MERCATOR = 'EPSG:3857'
+HALF_WORLD = 20037508.342789244
+# Tile coordinate resolution, and the margin (in the same units) of geometry
+# kept around each tile so that strokes do not break at tile edges.
+EXTENT = 4096
+BUFFER = 64
+# Deepest zoom tiles are cut at, the default of the CLI; the maps overzoom beyond it
+MAX_ZOOM = 14
+# Deepest zoom of a Mapbox map, where the layers cut up to MAX_ZOOM are still drawn
+MAP_MAX_ZOOM = 24
+
+TileLayer = namedtuple('TileLayer', ['name', 'min_zoom', 'max_zoom', 'properties'])
+
+LAYERS = [
+    TileLayer('provinces', 0, 8, ['NAME_1']),
+    TileLayer('barangays', 9, MAX_ZOOM, ['NAME_1', 'NAME_2', 'NAME_3']),
+    TileLayer('buildings', 13, MAX_ZOOM, ['b_type', 'city', 'capacity', 'suitarea', 'potential']),
+]
+
+
+def tile_bounds(z, x, y):
+    """Web-mercator bounds ``(minx, miny, maxx, maxy)`` of an XYZ tile."""
+    size = 2 * HALF_WORLD / 2 ** z
+    minx = -HALF_WORLD + x * size
+    maxy = HALF_WORLD - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_ranges(bounds, z):
+    """Per geometry bounds (n x 4, web mercator), the first and last tile x and y at zoom ``z``."""
+    size = 2 * HALF_WORLD / 2 ** z
+    last = 2 ** z - 1
+    x0 = np.clip(np.floor((bounds[:, 0] + HALF_WORLD) / size), 0, last).astype('int64')
+    x1 = np.clip(np.floor((bounds[:, 2] + HALF_WORLD) / size), 0, last).astype('int64')
+    y0 = np.clip(np.floor((HALF_WORLD - bounds[:, 3]) / size), 0, last).astype('int64')
+    y1 = np.clip(np.floor((HALF_WORLD - bounds[:, 1]) / size), 0, last).astype('int64')
+    return x0, x1, y0, y1
+
+
+def lonlat_to_mercator(lon, lat):
+    """Web-mercator ``(x, y)`` of a longitude and latitude in degrees."""
+    return lon * HALF_WORLD / 180, math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * HALF_WORLD / math.pi
+
+
+def data_bounds(dataset_folder=DATASET_FOLDER):
+    """Lon/lat bounds of the tile layers from the GeoParquet metadata of the cache, or None if unknown."""
+    import pyarrow.parquet as pq
+
+    cache_folder = Path(dataset_folder) / CACHE_FOLDER_NAME
+    boxes = []
+    for name in ['gadm_data', 'converted_gdf']:
+        try:
+            geo = json.loads(pq.read_metadata(cache_folder / f'{name}.parquet').metadata[b'geo'])
+            boxes.append(geo['columns'][geo['primary_column']]['bbox'])
+        except (OSError, KeyError, TypeError, ValueError):
+            return None
+    boxes = np.array(boxes, dtype='float64')
+    return (*boxes[:, :2].min(axis=0).tolist(), *boxes[:, 2:].max(axis=0).tolist())
+
+
+def _dissolve(regions, key):
+    import geopandas as gpd
+    import shapely
+
+    groups = regions.groupby(key, sort=False).indices
+    geometries = np.asarray(regions.geometry.values)
+    union = getattr(shapely, 'coverage_union_all', shapely.union_all)
+    merged = [union(geometries[positions]) for positions in groups.values()]
+    return gpd.GeoDataFrame({key: list(groups)}, geometry=merged, crs=regions.crs)
+
+
+def read_layers(dataset_folder=DATASET_FOLDER):
+    """Read the tile layers from the geodata cache, in web mercator."""
+    import geopandas as gpd
+
+    cache_folder = Path(dataset_folder) / CACHE_FOLDER_NAME
+    barangays = gpd.read_parquet(cache_folder / 'gadm_data.parquet',
+                                 columns=['NAME_1', 'NAME_2', 'NAME_3', 'geometry']).to_crs(WEB_MERCATOR)
+    buildings = gpd.read_parquet(cache_folder / 'converted_gdf.parquet',
+                                 columns=['b_type', 'city', 'capacity', 'suitarea', 'potential', 'geometry'])
+    return {
+        'provinces': _dissolve(barangays, 'NAME_1'),
+        'barangays': barangays,
+        'buildings': buildings.to_crs(WEB_MERCATOR),
+    }
+
+
+class VectorTileSource:
+    """Cut, store and serve the vector tiles of one version of the geodata cache."""
+
+    def __init__(self, dataset_folder=DATASET_FOLDER, layers=LAYERS):
+        self.dataset_folder = Path(dataset_folder)
+        self.layers = list(layers)
+        # The version of the data in the cache, which the sources may already be ahead of
+        self.version = (cache_fingerprint(dataset_folder) or source_fingerprint(dataset_folder))[:16]
+        self.folder = self.dataset_folder / CACHE_FOLDER_NAME / TILE_FOLDER_NAME / self.version
+        self.bounds = data_bounds(dataset_folder)
+        self._frames = None
+        self._load_lock = threading.Lock()
+
+    def url_template(self, base_url=''):
+        """Tile URL with ``{z}/{x}/{y}`` placeholders; Mapbox needs an absolute ``base_url``."""
+        return f'{base_url}{TILE_ROUTE}/{self.version}/{{z}}/{{x}}/{{y}}.pbf'
+
+    def tilejson_url(self, base_url=''):
+        return f'{base_url}{TILE_ROUTE}/{self.version}.json'
+
+    def tilejson(self, base_url=''):
+        """TileJSON of the tiles: their URL, zoom range and, when known, bounds."""
+        tilejson = {'tilejson': '2.2.0', 'tiles': [self.url_template(base_url)],
+                    'minzoom': min(layer.min_zoom for layer in self.layers), 'maxzoom': MAX_ZOOM}
+        if self.bounds is not None:
+            tilejson['bounds'] = list(self.bounds)
+        return tilejson
+
+    def _load(self):
+        # The footprints are only read, and indexed, once a tile is first cut.
+        import shapely
+
+        with self._load_lock:
+            if self._frames is None:
+                self._frames = {name: (frame, shapely.STRtree(np.asarray(frame.geometry.values)))
+                                for name, frame in read_layers(self.dataset_folder).items()}
+        return self._frames
+
+    def covers(self, z, x, y):
+        """Whether tile ``z/x/y``, with its buffer, overlaps the data (True if its bounds are unknown)."""
+        if self.bounds is None:
+            return True
+        min_x, min_y = lonlat_to_mercator(max(self.bounds[0], -180), max(self.bounds[1], -85.0511))
+        max_x, max_y = lonlat_to_mercator(min(self.bounds[2], 180), min(self.bounds[3], 85.0511))
+        bounds = tile_bounds(z, x, y)
+        margin = (bounds[2] - bounds[0]) / EXTENT * BUFFER
+        return (bounds[0] - margin <= max_x and bounds[2] + margin >= min_x
+                and bounds[1] - margin <= max_y and bounds[3] + margin >= min_y)
+
+    def render(self, z, x, y):
+        """Encode tile ``z/x/y`` as MVT bytes, or ``b''`` if it holds no features."""
+        import mapbox_vector_tile
+        import shapely
+
+        frames = self._load()
+        bounds = tile_bounds(z, x, y)
+        unit = (bounds[2] - bounds[0]) / EXTENT
+        margin = unit * BUFFER
+        clip_box = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+        layers = []
+        for layer in self.layers:
+            if not layer.min_zoom <= z <= layer.max_zoom:
+                continue
+            frame, tree = frames[layer.name]
+            hits = np.sort(tree.query(shapely.box(*clip_box)))
+            if not len(hits):
+                continue
+            geometries = shapely.clip_by_rect(np.asarray(frame.geometry.values)[hits], *clip_box)
+            # Detail finer than one tile unit is invisible at this zoom.
+            geometries = shapely.simplify(geometries, unit, preserve_topology=True)
+            keep = ~shapely.is_empty(geometries)
+            records = frame[layer.properties].iloc[hits[keep]].to_dict('records')
+            features = [{'geometry': geometry,
+                         'properties': {key: value for key, value in record.items() if not _is_missing(value)}}
+                        for geometry, record in zip(geometries[keep], records)]
+            if features:
+                layers.append({'name': layer.name, 'features': features})
+        if not layers:
+            return b''
+        return mapbox_vector_tile.encode(layers, default_options={'quantize_bounds': bounds, 'extents': EXTENT})
+
+    def tile(self, z, x, y):
+        """Gzipped tile bytes (``b''`` when empty), cut and stored on first use.
+
+        Empty tiles are not stored, and tiles outside the data not even cut.
+        """
+        path = self.folder / str(z) / str(x) / f'{y}.pbf'
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            pass
+        if not self.covers(z, x, y):
+            return b''
+        body = self.render(z, x, y)
+        if not body:
+            return b''
+        body = gzip.compress(body)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(body)
+        tmp_path.replace(path)
+        return body
+
+    def occupied_tiles(self, z):
+        """XYZ tiles at zoom ``z`` that contain features of the layers shown at that zoom."""
+        import shapely
+
+        tiles = set()
+        for layer in self.layers:
+            if not layer.min_zoom <= z <= layer.max_zoom:
+                continue
+            frame, _ = self._load()[layer.name]
+            x0, x1, y0, y1 = tile_ranges(shapely.bounds(np.asarray(frame.geometry.values)), z)
+            # Most geometries (every building) fit in one tile: handle those at once.
+            single = (x0 == x1) & (y0 == y1)
+            keys = np.unique(x0[single] * 2 ** z + y0[single])
+            tiles.update(zip((keys // 2 ** z).tolist(), (keys % 2 ** z).tolist()))
+            for tx0, tx1, ty0, ty1 in zip(x0[~single], x1[~single], y0[~single], y1[~single]):
+                tiles.update((tx, ty) for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1))
+        return sorted(tiles)
+
+    def pregenerate(self, max_zoom, min_zoom=0):
+        """Cut every non-empty tile from ``min_zoom`` to ``max_zoom``; return how many were written."""
+        count = 0
+        for z in range(min_zoom, max_zoom + 1):
+            for x, y in self.occupied_tiles(z):
+                if self.tile(z, x, y):
+                    count += 1
+        return count
+
+    def remove_stale(self):
+        """Delete the tiles of earlier cache versions."""
+        for folder in self.folder.parent.iterdir():
+            if folder.is_dir() and folder.name != self.version:
+                shutil.rmtree(folder, ignore_errors=True)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def register_tile_route(server, source, max_age=31536000):
+    """Serve the tiles from ``server`` with HTTP caching.
+
+    ``source`` is a ``VectorTileSource`` or a function returning the current
+    one.  Tiles are sent gzipped to clients that accept it, empty tiles as
+    204 No Content.
+    """
+    from flask import Response, abort, jsonify, request
+
+    current_source = source if callable(source) else lambda: source
+
+    @server.route(f'{TILE_ROUTE}/<version>.json')
+    def vector_tilejson(version):
+        tile_source = current_source()
+        # Mapbox fetches the tiles from a web worker, which needs absolute URLs
+        response = jsonify(tile_source.tilejson(request.host_url.rstrip('/')))
+        if version == tile_source.version:
+            response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @server.route(f'{TILE_ROUTE}/<version>/<int:z>/<int:x>/<int:y>.pbf')
+    def vector_tile(version, z, x, y):
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            abort(404)
+        tile_source = current_source()
+        etag = f'{tile_source.version}-{z}-{x}-{y}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            body = tile_source.tile(z, x, y)
+            if not body:
+                response = Response(status=204)
+            elif 'gzip' in request.accept_encodings:
+                response = Response(body, mimetype='application/vnd.mapbox-vector-tile')
+                response.headers['Content-Encoding'] = 'gzip'
+            else:
+                response = Response(gzip.decompress(body), mimetype='application/vnd.mapbox-vector-tile')
+        # Weak: the same tile is sent gzipped or not
+        response.set_etag(etag, weak=True)
+        response.headers['Vary'] = 'Accept-Encoding'
+        if version == tile_source.version:
+            response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        else:
+            # A URL of an earlier version (a map not re-rendered since a reload) gets the current tiles.
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    return vector_tile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-generate the vector tiles served by app.py.')
+    parser.add_argument('--datasets', default=str(DATASET_FOLDER), help='dataset folder (default: %(default)s)')
+    parser.add_argument('--min-zoom', type=int, default=0)
+    parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM)
+    args = parser.parse_args()
+    if args.max_zoom > MAX_ZOOM:
+        parser.error(f'--max-zoom is at most {MAX_ZOOM}, the deepest zoom tiles are served at')
+
+    from geodata_cache import load_artifacts
+
+    # Tiles are cut from the cache, so make sure it is up to date first.
+    load_artifacts(args.datasets, names=[])
+    source = VectorTileSource(args.datasets)
+    count = source.pregenerate(args.max_zoom, args.min_zoom)
+    source.remove_stale()
+    print(f'{count} tiles written to {source.folder}.')
+
+
+if __name__ == '__main__':
+    main()